@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+'''
+Benchmarks for the hot paths of masseval.
+
+The audio is generated synthetically (and deterministically), so no data
+set is needed.  Results are written as JSON and can be compared against an
+earlier run:
+
+    python benchmarks/run.py --output new.json
+    python benchmarks/run.py --output new.json --compare old.json
+'''
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pandas as pd
+from untwist import data
+
+import masseval
+
+
+def synthetic_stems(duration, sample_rate=44100, seed=0):
+    '''
+    Returns a dictionary of mono vocals, drums, bass and other waves of the
+    given duration (in seconds).  The same seed always gives the same audio.
+    '''
+
+    random = np.random.RandomState(seed)
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+
+    # Vocals: a gliding harmonic tone with syllable-like amplitude modulation
+    f0 = 220 * 2 ** (np.sin(2 * np.pi * 0.2 * t) / 6)
+    phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+    vocals = sum(np.sin(k * phase) / k for k in range(1, 8))
+    vocals *= 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t) ** 2
+
+    # Drums: decaying noise bursts at 120 bpm
+    beat = (t % 0.5) / 0.5
+    drums = random.randn(t.size) * np.exp(-30 * beat)
+
+    # Bass: low sawtooth-like tone
+    bass = sum(np.sin(2 * np.pi * k * 55 * t) / k for k in range(1, 4))
+
+    # Other: smoothed noise
+    other = np.convolve(random.randn(t.size), np.ones(32) / 32, 'same')
+
+    stems = {'vocals': vocals, 'drums': drums, 'bass': bass, 'other': other}
+
+    return {name: data.audio.Wave(0.1 * stem / np.abs(stem).max(),
+                                  sample_rate)
+            for name, stem in stems.items()}
+
+
+def sisec_df():
+    '''
+    The SiSEC 2017 results as used by data.get_sample(), without the audio
+    file paths (which need the data set).
+    '''
+
+    df = pd.read_csv(masseval.config.mus_csv)
+    df = df[(df.is_dev == 0) & (df.method != 'IBM')].copy()
+    df['filepath'] = ''
+
+    return df
+
+
+def references_without_files(sample):
+    '''
+    Stand-in for data.add_reference_to_sample(), which looks the reference
+    files up in the DSD100 data set: adds the reference rows of every track
+    without file paths.
+    '''
+
+    refs = []
+    for _, ref in sample.drop_duplicates('track_id').iterrows():
+        for stem in ['vocals', 'drums', 'bass', 'other']:
+            ref = ref.copy()
+            ref['method'] = 'ref'
+            ref['score'] = np.nan
+            ref['target'] = stem
+            refs.append(ref)
+
+    return pd.concat([sample, pd.DataFrame(refs)], ignore_index=True)
+
+
+def timeit(function, repeat):
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def benchmarks(duration, tmp_dir):
+    '''
+    Yields (name, function) for every benchmark at the given signal
+    duration.
+    '''
+
+    stems = synthetic_stems(duration)
+    target = stems['vocals']
+    others = [stems['drums'], stems['bass'], stems['other']]
+    estimates = [stem * 0.9 + 0.05 * stems['drums']
+                 for stem in [target] + others]
+
+    def anchor_create():
+        masseval.anchor.Anchor(target.copy(), others).create()
+
+    def remix_anchor_create():
+        masseval.anchor.RemixAnchor(target.copy(), others).create()
+
+    def find_active_portion():
+        masseval.audio.find_active_portion(target, min(7, duration), 75)
+
+    def segment():
+        # segment() fades in place
+        masseval.audio.segment(target.copy(), 0, target.num_frames)
+
+    def write_wav():
+        masseval.audio.write_wav(target.copy(),
+                                 os.path.join(tmp_dir, 'bench.wav'),
+                                 -23)
+
+    def bss_eval():
+        masseval.audio.bss_eval([target] + others, estimates)
+
+    yield 'Anchor.create', anchor_create
+    yield 'RemixAnchor.create', remix_anchor_create
+    yield 'find_active_portion', find_active_portion
+    yield 'segment', segment
+    yield 'write_wav', write_wav
+    yield 'bss_eval', bss_eval
+
+
+def run(durations, repeat):
+    '''
+    Runs all benchmarks and returns their results.  A benchmark that fails
+    is reported and left out, so the others are still written.
+    '''
+
+    results = []
+
+    def measure(name, duration, function):
+        try:
+            times = timeit(function, repeat)
+        except Exception as error:
+            print('{0:<22} {1!s:>8} s  failed: {2!r}'.format(name, duration,
+                                                             error))
+            return
+        results.append(summary(name, duration, times))
+        report(results[-1])
+
+    with TemporaryDirectory() as tmp_dir:
+
+        for duration in durations:
+            for name, function in benchmarks(duration, tmp_dir):
+                measure(name, duration, function)
+
+    df = sisec_df()
+
+    def get_sample():
+        np.random.seed(0)
+        masseval.data.get_sample(df, num_tracks=2, num_algos=4)
+
+    add_reference_to_sample = masseval.data.add_reference_to_sample
+    masseval.data.add_reference_to_sample = references_without_files
+    try:
+        measure('get_sample', None, get_sample)
+    finally:
+        masseval.data.add_reference_to_sample = add_reference_to_sample
+
+    return results
+
+
+def summary(name, duration, times):
+
+    return {'name': name,
+            'duration': duration,
+            'repeat': len(times),
+            'min': min(times),
+            'median': float(np.median(times)),
+            'mean': float(np.mean(times))}
+
+
+def report(result):
+
+    print('{name:<22} {duration!s:>8} s  min {min:9.4f} s  '
+          'median {median:9.4f} s'.format(**result))
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Prints the ratio of the median times to those in `baseline` and returns
+    the number of benchmarks slower by more than `tolerance`.
+    '''
+
+    old = {(r['name'], r['duration']): r for r in baseline['results']}
+
+    regressions = 0
+    for result in results:
+        key = (result['name'], result['duration'])
+        if key not in old:
+            continue
+        ratio = result['median'] / old[key]['median']
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  <-- regression'
+            regressions += 1
+        print('{0:<22} {1!s:>8} s  x{2:6.2f}{3}'.format(
+            key[0], key[1], ratio, flag))
+
+    return regressions
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--durations', type=float, nargs='+',
+                        default=[7, 30, 60],
+                        help='signal durations in seconds')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='JSON file to write results to')
+    parser.add_argument('--compare', help='JSON file of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative slow down before a '
+                             'benchmark counts as a regression')
+    args = parser.parse_args()
+
+    results = run(args.durations, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'masseval': masseval.__version__,
+                       'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'machine': platform.platform(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'results': results},
+                      file,
+                      indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,32 @@
 #!/usr/bin/env python
 """Musical Audio Source Separation (MASS) Evaluation Toolbox"""
 
+import importlib
+
 __version__ = '0.1'
 
-from . import audio
-from . import data
-from . import anchor
-from . import mushra
+# Submodules are imported on first access (PEP 562), so e.g. a worker that
+# only needs masseval.anchor does not import pandas, mir_eval or lxml.
+__all__ = [
+    'analysis',
+    'anchor',
+    'audio',
+    'cache',
+    'config',
+    'data',
+    'instrument',
+    'manifest',
+    'mushra',
+    'sessions',
+]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError(
+        "module '{0}' has no attribute '{1}'".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
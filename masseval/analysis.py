@@ -0,0 +1,333 @@
+import numpy as np
+import pandas as pd
+from . import config
+
+# Largest number of elements of a resample matrix processed at once
+max_block = 2 ** 22
+
+
+def _generators(seed, num):
+    '''
+    Returns `num' independent random generators derived from `seed' (an
+    integer, None or a numpy SeedSequence).
+    '''
+
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+
+    return [np.random.default_rng(child) for child in seed.spawn(num)]
+
+
+def _blocks(num_resamples, size):
+    '''
+    Returns the number of resamples in every block of at most `max_block'
+    indices.
+    '''
+
+    step = max(1, max_block // max(size, 1))
+
+    return [min(step, num_resamples - start)
+            for start in range(0, num_resamples, step)]
+
+
+def _map(function, items, workers):
+
+    if workers > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(workers) as executor:
+            return list(executor.map(function, items))
+
+    return [function(item) for item in items]
+
+
+def _interval(values, ci):
+    '''
+    Percentile interval of the resampled statistics in the rows of `values'.
+    '''
+
+    with np.errstate(invalid='ignore'):
+        return np.nanpercentile(values, [(100 - ci) / 2, (100 + ci) / 2],
+                                axis=0)
+
+
+def _resample(num, size, seed, workers):
+    '''
+    Yields blocks of bootstrap indices, (resamples, size) matrices which
+    together have `num' rows.  Each block is drawn by its own generator, so
+    the indices only depend on the seed and not on the number of workers.
+    '''
+
+    blocks = _blocks(num, size)
+
+    def draw(item):
+        num, random = item
+        return random.integers(0, size, (num, size))
+
+    return _map(draw, zip(blocks, _generators(seed, len(blocks))), workers)
+
+
+def _counts(indices):
+    '''
+    Returns how often every position is drawn in every row of `indices'.
+    '''
+
+    num, size = indices.shape
+    indices = indices + np.arange(num)[:, np.newaxis] * size
+
+    return np.bincount(indices.ravel(),
+                       minlength=num * size).reshape(num, size)
+
+
+def bootstrap(values, num_resamples=10000, ci=95, seed=None, workers=1):
+    '''
+    Returns a dictionary with the mean and median of `values' and their
+    bootstrap confidence intervals (`ci' in percent), as `mean_low',
+    `mean_high', `median_low' and `median_high'.
+
+    `values' is an array of samples or a (groups, samples) matrix, in which
+    case every entry of the dictionary is an array with one value per group.
+    All resamples are drawn as one (num_resamples, samples) index matrix,
+    which is shared by the groups, and the statistics are computed with
+    matrix operations.  The index matrix is drawn in blocks if it gets
+    large, using `workers' threads.
+    '''
+
+    values = np.asarray(values, dtype='float64')
+    squeeze = values.ndim == 1
+    # With sorted values, the statistics of a resample only depend on how
+    # often every position is drawn, which is the same for all groups and
+    # avoids sorting the resamples for the medians.
+    values = np.sort(np.atleast_2d(values), axis=1)
+    size = values.shape[1]
+
+    def statistics(indices):
+        counts = _counts(indices)
+        means = counts @ values.T / size
+        # Middle order statistics of every resample
+        cumulative = np.cumsum(counts, axis=1)
+        lower = (cumulative > (size - 1) // 2).argmax(axis=1)
+        upper = (cumulative > size // 2).argmax(axis=1)
+        medians = (values[:, lower] + values[:, upper]).T / 2
+        return means, medians
+
+    blocks = _map(statistics,
+                  _resample(num_resamples, size, seed, workers),
+                  workers)
+    means = np.concatenate([means for means, _ in blocks])
+    medians = np.concatenate([medians for _, medians in blocks])
+
+    mean_low, mean_high = _interval(means, ci)
+    median_low, median_high = _interval(medians, ci)
+
+    stats = {'n': np.full(len(values), size),
+             'mean': values.mean(axis=1),
+             'mean_low': mean_low,
+             'mean_high': mean_high,
+             'median': np.median(values, axis=1),
+             'median_low': median_low,
+             'median_high': median_high}
+
+    if squeeze:
+        return {name: stat[0] for name, stat in stats.items()}
+
+    return stats
+
+
+def _by_size(arrays):
+    '''
+    Returns a dictionary of size -> positions of the arrays of that size.
+    '''
+
+    positions = {}
+    for position, array in enumerate(arrays):
+        positions.setdefault(len(array), []).append(position)
+
+    return positions
+
+
+def summary(results,
+            by=['method'],
+            value='rating',
+            num_resamples=10000,
+            ci=95,
+            seed=None,
+            workers=1):
+    '''
+    Returns the mean and median of `value' for every group of `by' (e.g.
+    ['question', 'level', 'method']) of the ratings in `results' (see
+    mushra.results_from_files), with bootstrap confidence intervals.
+
+    Groups of the same size (e.g. all of them in a complete design) are
+    resampled together, see bootstrap().
+    '''
+
+    groups = list(results.dropna(subset=[value]).groupby(by)[value])
+    arrays = [group.values for _, group in groups]
+
+    sizes = _by_size(arrays)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    rows = [None] * len(groups)
+    for (size, positions), size_seed in zip(sorted(sizes.items()), seeds):
+        stats = bootstrap([arrays[i] for i in positions],
+                          num_resamples, ci, size_seed, workers)
+        for j, i in enumerate(positions):
+            rows[i] = {name: stat[j] for name, stat in stats.items()}
+
+    index = pd.MultiIndex.from_tuples(
+        [key if isinstance(key, tuple) else (key,) for key, _ in groups],
+        names=by)
+
+    return pd.DataFrame(rows, index=index).reset_index()
+
+
+def _ranks(values, counts):
+    '''
+    Returns the rank of every one of `values' within the resamples given by
+    `counts' (resamples, len(values)), ties get their average rank.
+    '''
+
+    unique, inverse = np.unique(values, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+
+    # How often every unique value is drawn, and how many smaller ones
+    drawn = counts[:, order]
+    if len(unique) < len(values):
+        starts = np.searchsorted(inverse[order], np.arange(len(unique)))
+        drawn = np.add.reduceat(drawn, starts, axis=1)
+    below = np.cumsum(drawn, axis=1) - drawn
+
+    return (below + (drawn + 1) / 2)[:, inverse]
+
+
+def _pearson(x, y, counts):
+    '''
+    Pearson correlation of `x' and `y' within the resamples given by
+    `counts', along the last axis.
+    '''
+
+    def dot(values):
+        return np.einsum('...i,...i->...', counts, values)
+
+    size = counts.sum(axis=-1)
+    sum_x, sum_y = dot(x), dot(y)
+    covariance = dot(x * y) - sum_x * sum_y / size
+    variance_x = dot(x * x) - sum_x ** 2 / size
+    variance_y = dot(y * y) - sum_y ** 2 / size
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return covariance / np.sqrt(variance_x * variance_y)
+
+
+def bootstrap_correlation(x, y, num_resamples=10000, ci=95, seed=None,
+                          workers=1):
+    '''
+    Returns a dictionary with the Pearson and Spearman correlation of `x'
+    and `y' and their bootstrap confidence intervals (`ci' in percent).
+
+    As in bootstrap(), `x' and `y' can be (groups, samples) matrices and
+    the pairs are resampled with one index matrix shared by all groups.
+    Resamples are represented by how often every pair is drawn, so neither
+    the resampled pairs nor their ranks need sorting.
+    '''
+
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    squeeze = x.ndim == 1
+    x, y = np.atleast_2d(x), np.atleast_2d(y)
+    size = x.shape[1]
+
+    def correlations(counts):
+        pearson = np.empty((len(counts), len(x)))
+        spearman = np.empty((len(counts), len(x)))
+        for group in range(len(x)):
+            pearson[:, group] = _pearson(x[group], y[group], counts)
+            spearman[:, group] = _pearson(_ranks(x[group], counts),
+                                          _ranks(y[group], counts),
+                                          counts)
+        return pearson, spearman
+
+    blocks = _map(lambda indices: correlations(_counts(indices) * 1.0),
+                  _resample(num_resamples, size, seed, workers),
+                  workers)
+    pearson = np.concatenate([pearson for pearson, _ in blocks])
+    spearman = np.concatenate([spearman for _, spearman in blocks])
+
+    pearson_low, pearson_high = _interval(pearson, ci)
+    spearman_low, spearman_high = _interval(spearman, ci)
+
+    pearson, spearman = correlations(np.ones((1, size)))
+
+    stats = {'n': np.full(len(x), size),
+             'pearson': pearson[0],
+             'pearson_low': pearson_low,
+             'pearson_high': pearson_high,
+             'spearman': spearman[0],
+             'spearman_low': spearman_low,
+             'spearman_high': spearman_high}
+
+    if squeeze:
+        return {name: stat[0] for name, stat in stats.items()}
+
+    return stats
+
+
+def correlations(results,
+                 by=['question', 'level'],
+                 target='vocals',
+                 metrics=['SDR', 'SIR', 'SAR', 'ISR'],
+                 df=None,
+                 num_resamples=10000,
+                 ci=95,
+                 seed=None,
+                 workers=1):
+    '''
+    Correlates the mean rating of every track and method in `results' (see
+    mushra.results_from_files) with the objective SiSEC metrics of
+    `target', for every group of `by'.
+
+    The objective scores are taken from `df' (default: the SiSEC 2017
+    results in config.mus_csv).  Ratings of methods without scores, like
+    the reference and anchors, are ignored.
+
+    Returns a DataFrame with the Pearson and Spearman correlations and
+    their bootstrap confidence intervals, one row per group and objective
+    metric (column `objective').
+    '''
+
+    if df is None:
+        df = pd.read_csv(config.mus_csv)
+
+    scores = df[(df.target == target) &
+                (df.metric.isin(metrics))].pivot_table(
+        index=['track_id', 'method'], columns='metric', values='score')
+
+    ratings = results.groupby(
+        by + ['track_id', 'method'])['rating'].mean().reset_index()
+    ratings = ratings.merge(scores.reset_index(),
+                            on=['track_id', 'method'])
+
+    rows = []
+    pairs = []
+    for key, group in ratings.groupby(by):
+        for metric in metrics:
+            if metric not in group:
+                continue
+            pair = group[[metric, 'rating']].dropna().values
+            row = dict(zip(by, key if isinstance(key, tuple) else (key,)))
+            row['objective'] = metric
+            rows.append(row)
+            pairs.append(pair)
+
+    sizes = _by_size(pairs)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    for (size, positions), size_seed in zip(sorted(sizes.items()), seeds):
+        x = [pairs[i][:, 0] for i in positions]
+        y = [pairs[i][:, 1] for i in positions]
+        stats = bootstrap_correlation(x, y, num_resamples, ci, size_seed,
+                                      workers)
+        for j, i in enumerate(positions):
+            rows[i].update({name: stat[j] for name, stat in stats.items()})
+
+    return pd.DataFrame(rows)
@@ -1,6 +1,7 @@
 from collections import namedtuple
 import numpy as np
 from untwist import data, utilities, transforms
+from . import instrument
 
 
 Anchors = namedtuple('Anchors', ['Distortion',
@@ -10,6 +11,125 @@ Anchors = namedtuple('Anchors', ['Distortion',
                      )
 
 
+class OverlapAdd:
+    '''
+    Short-time Fourier processing of a signal in blocks of frames with
+    weighted overlap-add resynthesis.  Only `block_size` frames of the
+    spectrogram are held in memory at a time, so the working set does not
+    grow with the length of the signal.  If `block_size` is None, the whole
+    spectrogram is processed at once.  The signal (and `out`) may be
+    memory-mapped arrays, e.g. from scipy.io.wavfile.read(..., mmap=True).
+
+    The transforms are real FFTs from scipy.fft (pocketfft), computed in the
+    precision of `window`: a float32 window gives float32/complex64
+    processing.  `workers` is passed on to scipy.fft for multi-threading.
+
+    The input is padded with `window_size - hop_size` zeros at the start and
+    framed until every sample is covered by `window_size / hop_size` frames,
+    so an unmodified spectrogram reconstructs the input exactly.
+    '''
+
+    def __init__(self, window, hop_size, block_size=256, workers=None):
+
+        window_size = len(window)
+        if window_size % hop_size:
+            raise ValueError('window size must be a multiple of hop size.')
+
+        self.window = np.asarray(window)
+        self.window_size = window_size
+        self.hop_size = hop_size
+        self.block_size = block_size
+        self.workers = workers
+        self.pad = window_size - hop_size
+        self.overlap = window_size // hop_size
+
+        # Synthesis window with the overlap-add normalisation folded in
+        norm = (self.window ** 2).reshape(self.overlap, hop_size).sum(0)
+        self.synthesis_window = self.window / np.tile(norm, self.overlap)
+
+    def num_frames(self, num_samples):
+        '''
+        Number of STFT frames used for a signal of `num_samples` samples.
+        '''
+        return (num_samples - 1 + self.pad) // self.hop_size + 1
+
+    def blocks(self, num_samples):
+        '''
+        Yields (first_frame, last_frame + 1) for every block of frames.
+        '''
+        num_frames = self.num_frames(num_samples)
+        block_size = self.block_size or num_frames
+        for start in range(0, num_frames, block_size):
+            yield start, min(start + block_size, num_frames)
+
+    def _read(self, signal, start, stop):
+        '''
+        Samples [start, stop) of `signal`, zero filled outside the signal.
+        '''
+        block = np.zeros((stop - start,) + signal.shape[1:], self.window.dtype)
+        lo, hi = max(start, 0), min(stop, signal.shape[0])
+        if hi > lo:
+            block[lo - start:hi - start] = signal[lo:hi]
+        return block
+
+    def process(self, signal, modify, out=None):
+        '''
+        signal:
+            Array of shape (samples, channels).
+        modify:
+            Called as modify(spectrogram, first_frame) for every block, where
+            spectrogram is a (channels, bins, frames) view that can be
+            changed in place.
+        out:
+            Optional array of the same shape as signal to write into.
+
+        Returns the resynthesised signal.
+        '''
+
+        from scipy import fft
+
+        num_samples = signal.shape[0]
+        if out is None:
+            out = np.zeros(signal.shape, self.window.dtype)
+        else:
+            out[:] = 0
+
+        hop = self.hop_size
+
+        for first, last in self.blocks(num_samples):
+
+            num = last - first
+            start = first * hop - self.pad
+            stop = start + (num - 1) * hop + self.window_size
+            block = self._read(signal, start, stop)
+
+            # (frames, channels, window_size)
+            frames = np.lib.stride_tricks.sliding_window_view(
+                block, self.window_size, axis=0)[::hop]
+            spectrum = fft.rfft(frames * self.window, axis=-1,
+                                workers=self.workers)
+
+            modify(spectrum.transpose(1, 2, 0), first)
+
+            frames = fft.irfft(spectrum, self.window_size, axis=-1,
+                               workers=self.workers)
+            frames *= self.synthesis_window
+
+            # Overlap-add: split each frame into hop sized parts
+            frames = frames.reshape(num, -1, self.overlap, hop)
+            summed = np.zeros((num + self.overlap - 1, frames.shape[1], hop),
+                              frames.dtype)
+            for i in range(self.overlap):
+                summed[i:i + num] += frames[:, :, i]
+            summed = summed.transpose(0, 2, 1).reshape(-1, frames.shape[1])
+
+            lo, hi = max(start, 0), min(start + len(summed), num_samples)
+            if hi > lo:
+                out[lo:hi] += summed[lo - start:hi - start]
+
+        return out
+
+
 class Anchor:
     '''
     Anchor signals for a MUSHRA test assessing source separation
@@ -38,16 +158,40 @@ class Anchor:
                  low_pass_cutoff=3500,
                  include_background_in_quality_anchor=True,
                  loudness_normalise_interferer=True,
+                 block_size=None,
+                 stft_backend='untwist',
+                 workers=None,
+                 share_mask=True,
                  ):
         '''
         target:
-            The target audio, e.g. vocals
+            The target audio, e.g. vocals.  Multichannel waves are
+            processed with all channels in one transform (OverlapAdd).
         others:
             Can be a list of everthing else, or just the accompaniment (Wave).
         trim_factor_distorted:
             Proportion of spectral frames to remove randomly in time.
         trim_factor_artefacts:
             Proportion of time-frequency bins to randomly remove.
+        block_size:
+            If given, the STFT is processed in blocks of this many frames
+            (see OverlapAdd), which bounds the memory needed for long
+            signals.  The frame and bin dropout rates are the same as when
+            processing the whole spectrogram at once.
+        stft_backend:
+            'untwist' processes in double precision: with untwist's
+            STFT/ISTFT for a mono target as a whole, otherwise (with
+            `block_size' or a multichannel target) with the float64 FFTs
+            of scipy.fft through OverlapAdd.  'scipy' uses the real FFTs
+            of scipy.fft in float32/complex64, which is considerably
+            faster and reconstructs the unmodified signal to within
+            float32 precision.
+        workers:
+            Number of threads for the 'scipy' backend (-1 for all cores).
+        share_mask:
+            For multichannel targets, remove the same frames and bins in
+            every channel (coherent artefacts).  If False, the dropout is
+            drawn independently per channel.
         '''
 
         from scipy import signal
@@ -66,6 +210,24 @@ class Anchor:
         window = signal.get_window('hann', points, True)
         self.stft = transforms.STFT(window, points, points // 2)
         self.istft = transforms.ISTFT(window, points, points // 2)
+        self.num_bins = points // 2 + 1
+
+        if stft_backend not in ('untwist', 'scipy'):
+            raise ValueError('stft_backend must be untwist or scipy.')
+        self.stft_backend = stft_backend
+
+        if stft_backend == 'scipy':
+            self.overlap_add = OverlapAdd(window.astype('float32'),
+                                          points // 2,
+                                          block_size,
+                                          workers)
+        elif block_size or target.num_channels > 1:
+            # untwist's STFT is mono only
+            self.overlap_add = OverlapAdd(window, points // 2, block_size)
+        else:
+            self.overlap_add = None
+
+        self.num_masks = 1 if share_mask else target.num_channels
 
         self.cut_off = utilities.conversion.nearest_bin(low_pass_cutoff,
                                                         points,
@@ -76,6 +238,20 @@ class Anchor:
         self.include_background_in_quality_anchor = include_background_in_quality_anchor
         self.loudness_normalise_interferer = loudness_normalise_interferer
 
+        # Everything (apart from the audio) the anchors depend on
+        self.parameters = {
+            'trim_factor_distorted': trim_factor_distorted,
+            'trim_factor_artefacts': trim_factor_artefacts,
+            'low_pass_artefacts': low_pass_artefacts,
+            'low_pass_cutoff': low_pass_cutoff,
+            'include_background_in_quality_anchor':
+                include_background_in_quality_anchor,
+            'loudness_normalise_interferer': loudness_normalise_interferer,
+            'block_size': block_size,
+            'stft_backend': stft_backend,
+            'share_mask': share_mask,
+        }
+
     def distorted_anchor(self):
         '''
         Returns the distortion signal created by low-pass filtering the
@@ -87,6 +263,9 @@ class Anchor:
         exactly!
         '''
 
+        if self.overlap_add is not None:
+            return self._distorted_anchor_blocks()
+
         x_fft = self.stft.process(self.target)
 
         x_fft[self.cut_off:] = 0
@@ -125,6 +304,9 @@ class Anchor:
         zeroing 99% of the time-frequency bins, see [1].
         '''
 
+        if self.overlap_add is not None:
+            return self._artefacts_blocks()
+
         x_fft = self.stft.process(self.target)
 
         idx = np.random.choice(
@@ -143,6 +325,58 @@ class Anchor:
 
         return artefacts[:self.target.num_frames]
 
+    def _process_blocks(self, modify):
+
+        out = self.overlap_add.process(np.asarray(self.target), modify)
+
+        return data.audio.Wave(out, self.target.sample_rate)
+
+    def _distorted_anchor_blocks(self):
+        '''
+        Overlap-add version of distorted_anchor().  The frames to remove are
+        drawn once for the whole signal, either for all channels or for each
+        channel.
+        '''
+
+        num_frames = self.overlap_add.num_frames(self.target.num_frames)
+        remove = np.zeros((self.num_masks, num_frames), dtype=bool)
+        for mask in remove:
+            mask[np.random.choice(num_frames,
+                                  int(num_frames * self.trim_factor_distorted),
+                                  replace=False)] = True
+
+        def modify(x_fft, first):
+            x_fft[:, self.cut_off:] = 0
+            block = remove[:, np.newaxis, first:first + x_fft.shape[-1]]
+            x_fft[np.broadcast_to(block, x_fft.shape)] = 0
+
+        return self._process_blocks(modify)
+
+    def _artefacts_blocks(self):
+        '''
+        Overlap-add version of artefacts().  Each block removes its share of
+        bins such that the running total matches the overall trim factor.
+        '''
+
+        def modify(x_fft, first):
+
+            size = x_fft.shape[1] * x_fft.shape[2]
+            done = first * self.num_bins
+            num = (int((done + size) * self.trim_factor_artefacts) -
+                   int(done * self.trim_factor_artefacts))
+
+            remove = np.zeros((self.num_masks, size), dtype=bool)
+            for mask in remove:
+                mask[np.random.choice(size, num, replace=False)] = True
+            remove = remove.reshape((self.num_masks,) + x_fft.shape[1:])
+
+            x_fft[np.broadcast_to(remove, x_fft.shape)] = 0
+
+            if self.low_pass_artefacts:
+                x_fft[:, self.cut_off:] = 0
+
+        return self._process_blocks(modify)
+
     def artefacts_anchor(self):
         '''
         Artefacts anchor for a MUSHRA listening test.
@@ -184,6 +418,7 @@ class Anchor:
 
         return anchor
 
+    @instrument.timed('Anchor.create')
     def create(self):
 
         return Anchors(self.distorted_anchor(),
@@ -201,7 +436,11 @@ class RemixAnchor():
                  trim_factor_artefacts=0.99,
                  target_level_offset=-14,
                  quality_anchor_loudness_balance=[0, 0],
-                 low_pass_cutoff=3500):
+                 low_pass_cutoff=3500,
+                 block_size=None,
+                 stft_backend='untwist',
+                 workers=None,
+                 share_mask=True):
         '''
         target:
             The target audio, e.g. vocals
@@ -217,6 +456,8 @@ class RemixAnchor():
             The desired loudness balance of [distorted_audio, artefacts], e.g.
             setting [10, 0] would set the distorted audio to be 10 LU above
             the artefacts. Default is [0, 0] = equal loudness.
+        block_size, stft_backend, workers, share_mask:
+            STFT processing options, see Anchor.
         '''
 
         # We need a single background
@@ -233,13 +474,24 @@ class RemixAnchor():
                                  trim_factor_distorted,
                                  trim_factor_artefacts,
                                  low_pass_artefacts=True,
-                                 low_pass_cutoff=low_pass_cutoff)
+                                 low_pass_cutoff=low_pass_cutoff,
+                                 block_size=block_size,
+                                 stft_backend=stft_backend,
+                                 workers=workers,
+                                 share_mask=share_mask)
 
         self.target_level_offset = target_level_offset
 
         self.quality_anchor_loudness_balance = np.array(
             quality_anchor_loudness_balance)
 
+        # Everything (apart from the audio) the anchors depend on
+        self.parameters = dict(
+            self.anchor_gen.parameters,
+            target_level_offset=target_level_offset,
+            quality_anchor_loudness_balance=list(
+                quality_anchor_loudness_balance))
+
     def distorted_anchor(self):
         '''
         Returns the distortion mix created by low-pass filtering the
@@ -304,6 +556,7 @@ class RemixAnchor():
 
         return anchor
 
+    @instrument.timed('RemixAnchor.create')
     def create(self):
 
         return Anchors(self.distorted_anchor(),
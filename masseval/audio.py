@@ -1,14 +1,32 @@
+from itertools import repeat
 from tempfile import TemporaryDirectory
 import collections
+import hashlib
 import os
 import pandas as pd
 import numpy as np
-from mir_eval import separation
 from untwist import (data, transforms, utilities)
 from . import anchor
-import matlab_wrapper
+from . import config
+from . import instrument
+from . import manifest as manifest_module
+from . import sessions
 
 
+BssEvalStats = collections.namedtuple('BssEvalStats', 'sdr sir sar perm')
+
+StatsPEASS = collections.namedtuple('StatsPEASS', ['ops',
+                                                   'tps',
+                                                   'ips',
+                                                   'aps',
+                                                   ]
+                                    )
+
+# Options given to PEASS_ObjectiveMeasure, also part of the cache keys
+PEASS_OPTIONS = {'segmentationFactor': 1}
+
+
+@instrument.timed('load_audio')
 def load_audio(df,
                force_mono=False,
                start=None,
@@ -20,6 +38,8 @@ def load_audio(df,
     out = {}
     for item in df.iterrows():
         wav = data.audio.Wave.read(item[1]['filepath'])
+        instrument.record('load_audio',
+                          bytes_read=os.path.getsize(item[1]['filepath']))
         if force_mono:
             wav = wav.as_mono()
 
@@ -31,6 +51,7 @@ def load_audio(df,
     return out
 
 
+@instrument.timed('find_active_portion')
 def find_active_portion(wave, duration, perc=90):
     '''
     Returns the start and end sample indices of an active portion of the audio
@@ -65,6 +86,7 @@ def segment(wave, start, end, ramp_dur=0.02):
     return wave
 
 
+@instrument.reported('write_mixtures_from_sample')
 def write_mixtures_from_sample(sample,
                                target='vocals',
                                directory=None,
@@ -72,10 +94,53 @@ def write_mixtures_from_sample(sample,
                                target_loudness=-23,
                                mixing_levels=[-12, -6, 0, 6, 12],
                                segment_duration=7,
-                               save_sources=False):
+                               save_sources=False,
+                               block_size=None,
+                               stft_backend='untwist',
+                               workers=None,
+                               share_mask=True,
+                               manifest=None,
+                               shard=None,
+                               num_shards=None,
+                               profile=None):
+    '''
+    `block_size', `stft_backend', `workers' and `share_mask' are passed on
+    to anchor.RemixAnchor, e.g. to create the anchors of full length tracks
+    block-wise in float32.
+
+    If `manifest' is True (or a manifest.Manifest), the written files are
+    recorded in a manifest in `directory' and tracks whose input files and
+    parameters are unchanged since they were written are skipped, see
+    manifest.Manifest.
+
+    With `num_shards', only the tracks of shard `shard' (0 to num_shards -
+    1) are written, see manifest.select_shard, and the manifest is one per
+    shard (to be combined with manifest.merge).
+
+    If `profile' is True, a table of the calls, time and bytes read and
+    written of every stage (load_audio, write_wav, ...) is printed at the
+    end, if it is a filename, the counters per stage and track are written
+    to it as JSON, see instrument.
+    '''
+
+    sample = manifest_module.select_shard(sample, shard, num_shards)
+    manifest = manifest_module.from_argument(manifest, directory, shard,
+                                             num_shards)
+    parameters = {
+        'target': target,
+        'force_mono': force_mono,
+        'target_loudness': target_loudness,
+        'mixing_levels': list(mixing_levels),
+        'segment_duration': segment_duration,
+        'save_sources': save_sources,
+        # `workers' only changes the speed, not the anchors
+        'block_size': block_size,
+        'stft_backend': stft_backend,
+        'share_mask': share_mask,
+    }
 
     # Iterate over the tracks and write audio out:
-    for idx, g_sample in sample.groupby('track_id'):
+    for idx, g_sample in instrument.tracks(sample.groupby('track_id')):
 
         # Prepare saving of audio
         folder = '{0}-{1}-{2}'.format(
@@ -83,6 +148,19 @@ def write_mixtures_from_sample(sample,
             g_sample.iloc[0]['track_id'],
             g_sample.iloc[0]['metric'])
 
+        if manifest is not None:
+            key = 'write_mixtures_from_sample/' + folder
+            inputs = manifest.input_digests(g_sample['filepath'].dropna())
+            if manifest.is_current(key, inputs, parameters):
+                continue
+
+        # Files written for this track
+        outputs = []
+
+        def write(sig, filename, *args):
+            outputs.append(filename)
+            return write_wav(sig, filename, *args)
+
         full_path = os.path.join(directory, folder)
 
         if not os.path.exists(full_path):
@@ -117,17 +195,17 @@ def write_mixtures_from_sample(sample,
             name = 'ref_mix_{}dB'.format(level)
             new_target = utilities.conversion.db_to_amp(level) * target_audio
             mix = new_target + accomp_audio
-            level_dif = write_wav(mix, os.path.join(full_path, name + '.wav'),
-                                  target_loudness)
+            level_dif = write(mix, os.path.join(full_path, name + '.wav'),
+                              target_loudness)
 
             if save_sources:
 
-                write_wav(
+                write(
                     new_target * utilities.conversion.db_to_amp(level_dif),
                     os.path.join(full_path, name + '_target.wav'),
                     None)
 
-                write_wav(
+                write(
                     accomp_audio * utilities.conversion.db_to_amp(level_dif),
                     os.path.join(full_path, name + '_accomp.wav'),
                     None)
@@ -138,7 +216,11 @@ def write_mixtures_from_sample(sample,
                     trim_factor_distorted=0.2,
                     trim_factor_artefacts=0.99,
                     target_level_offset=-14,
-                    quality_anchor_loudness_balance=[0, 0])
+                    quality_anchor_loudness_balance=[0, 0],
+                    block_size=block_size,
+                    stft_backend=stft_backend,
+                    workers=workers,
+                    share_mask=share_mask)
 
             anchors = creator.create()
 
@@ -153,21 +235,21 @@ def write_mixtures_from_sample(sample,
 
                 wav = getattr(anchors, anchor_type)
 
-                dif = write_wav(wav,
-                                os.path.join(full_path, name + '.wav'),
-                                target_loudness)
+                dif = write(wav,
+                            os.path.join(full_path, name + '.wav'),
+                            target_loudness)
 
                 if (anchor_type == 'Interferer') and save_sources:
 
                     anchor_tgt, anchor_accomp = creator.interferer_anchor_both_sources()
 
-                    write_wav(anchor_tgt * utilities.conversion.db_to_amp(dif),
-                              os.path.join(full_path, name + '_target.wav'),
-                              None)
+                    write(anchor_tgt * utilities.conversion.db_to_amp(dif),
+                          os.path.join(full_path, name + '_target.wav'),
+                          None)
 
-                    write_wav(anchor_accomp * utilities.conversion.db_to_amp(dif),
-                              os.path.join(full_path, name + '_accomp.wav'),
-                              None)
+                    write(anchor_accomp * utilities.conversion.db_to_amp(dif),
+                          os.path.join(full_path, name + '_accomp.wav'),
+                          None)
 
         # Mixes per method
         not_ref_sample = g_sample[g_sample.method != 'ref']
@@ -213,23 +295,27 @@ def write_mixtures_from_sample(sample,
                 new_target = utilities.conversion.db_to_amp(level) * target_audio
                 mix = new_target + accomp
 
-                level_dif = write_wav(mix,
-                                      os.path.join(full_path, name + '.wav'),
-                                      target_loudness)
+                level_dif = write(mix,
+                                  os.path.join(full_path, name + '.wav'),
+                                  target_loudness)
 
                 if save_sources:
 
-                    write_wav(
+                    write(
                         new_target * utilities.conversion.db_to_amp(level_dif),
                         os.path.join(full_path, name + '_target.wav'),
                         None)
 
-                    write_wav(
+                    write(
                         accomp * utilities.conversion.db_to_amp(level_dif),
                         os.path.join(full_path, name + '_accomp.wav'),
                         None)
 
+        if manifest is not None:
+            manifest.record(key, inputs, parameters, outputs, idx)
+
 
+@instrument.reported('write_target_from_sample')
 def write_target_from_sample(sample,
                              target='vocals',
                              directory=None,
@@ -242,6 +328,16 @@ def write_target_from_sample(sample,
                              loudness_normalise_interferer=True,
                              suffix=None,
                              overall_gain=0,
+                             seed=None,
+                             anchor_cache=None,
+                             block_size=None,
+                             stft_backend='untwist',
+                             workers=None,
+                             share_mask=True,
+                             manifest=None,
+                             shard=None,
+                             num_shards=None,
+                             profile=None,
                              ):
     '''
     (More doc needed)
@@ -253,10 +349,75 @@ def write_target_from_sample(sample,
 
     If you do not want to loudness normalise stimuli, set `target_loudness' to
     None.
+
+    If `seed' is given, numpy's random generator is seeded before the
+    anchors of each track are created (with a seed derived from `seed' and
+    the track id, see track_seed()), which makes them reproducible.  In
+    that case an `anchor_cache' (cache.AnchorCache) can be given to reuse
+    anchors from earlier runs with the same audio, parameters and seed.
+
+    `block_size', `stft_backend', `workers' and `share_mask' are passed on
+    to anchor.Anchor, e.g. to create the anchors of full length tracks
+    block-wise in float32.
+
+    If `manifest' is True (or a manifest.Manifest), the written files are
+    recorded in a manifest in `directory' and tracks whose input files and
+    parameters are unchanged since they were written are skipped, see
+    manifest.Manifest.
+
+    With `num_shards', only the tracks of shard `shard' (0 to num_shards -
+    1) are written, see manifest.select_shard, and the manifest is one per
+    shard (to be combined with manifest.merge).
+
+    If `profile' is True, a table of the calls, time and bytes read and
+    written of every stage (load_audio, write_wav, ...) is printed at the
+    end, if it is a filename, the counters per stage and track are written
+    to it as JSON, see instrument.
     '''
 
+    sample = manifest_module.select_shard(sample, shard, num_shards)
+    manifest = manifest_module.from_argument(manifest, directory, shard,
+                                             num_shards)
+    parameters = {
+        'target': target,
+        'force_mono': force_mono,
+        'target_loudness': target_loudness,
+        'segment_duration': segment_duration,
+        'trim_factor_distorted': trim_factor_distorted,
+        'include_background_in_quality_anchor':
+            include_background_in_quality_anchor,
+        'loudness_normalise_interferer': loudness_normalise_interferer,
+        'suffix': suffix,
+        'overall_gain': overall_gain,
+        'seed': seed,
+        # `workers' only changes the speed, not the anchors
+        'block_size': block_size,
+        'stft_backend': stft_backend,
+        'share_mask': share_mask,
+    }
+
     # Iterate over the tracks and write audio out:
-    for idx, g_sample in sample.groupby('track_id'):
+    for idx, g_sample in instrument.tracks(sample.groupby('track_id')):
+
+        if manifest is not None:
+            key = 'write_target_from_sample/{0}-{1}-{2}'.format(
+                target,
+                g_sample.iloc[0]['track_id'],
+                g_sample.iloc[0]['metric'])
+            inputs = manifest.input_digests(g_sample['filepath'].dropna())
+            track_parameters = dict(parameters)
+            if isinstance(song_start_and_end_times, dict):
+                track_parameters['start_and_end_time'] = (
+                    song_start_and_end_times.get(str(idx)))
+            if manifest.is_current(key, inputs, track_parameters):
+                continue
+
+        # Files written for this track
+        outputs = []
+
+        def write(sig, filename, *args):
+            outputs.append(filename)
+            return write_wav(sig, filename, *args)
 
         ref_sample = g_sample[g_sample.method == 'ref']
 
@@ -302,9 +463,25 @@ def write_target_from_sample(sample,
             trim_factor_distorted=trim_factor_distorted,
             include_background_in_quality_anchor=include_background_in_quality_anchor,
             loudness_normalise_interferer=loudness_normalise_interferer,
+            block_size=block_size,
+            stft_backend=stft_backend,
+            workers=workers,
+            share_mask=share_mask,
         )
 
-        anchors = anchor_creator.create()
+        anchors = None
+        if seed is not None:
+            seed_of_track = track_seed(seed, idx)
+            if anchor_cache is not None:
+                cache_key = anchor_cache.key(anchor_creator, seed_of_track)
+                anchors = anchor_cache.get(cache_key)
+
+        if anchors is None:
+            if seed is not None:
+                np.random.seed(seed_of_track)
+            anchors = anchor_creator.create()
+            if seed is not None and anchor_cache is not None:
+                anchor_cache.put(cache_key, anchors)
 
         # Write audio
         folder = '{0}-{1}-{2}'.format(
@@ -325,14 +502,14 @@ def write_target_from_sample(sample,
                 name += suffix
 
             # The reference
-            dif = write_wav(wav, os.path.join(full_path, name + '.wav'),
-                            target_loudness, overall_gain)
+            dif = write(wav, os.path.join(full_path, name + '.wav'),
+                        target_loudness, overall_gain)
 
             # The accompaniment
-            write_wav(sum(list_of_others) *
-                      utilities.conversion.db_to_amp(dif),
-                      os.path.join(full_path, name + '_accompaniment.wav'),
-                      None, overall_gain)
+            write(sum(list_of_others) *
+                  utilities.conversion.db_to_amp(dif),
+                  os.path.join(full_path, name + '_accompaniment.wav'),
+                  None, overall_gain)
 
         # Write out the other stems
         for name, wav in others.items():
@@ -342,16 +519,16 @@ def write_target_from_sample(sample,
             if suffix:
                 name += suffix
 
-            write_wav(wav * utilities.conversion.db_to_amp(dif),
-                      os.path.join(full_path, name + '.wav'),
-                      None, overall_gain)
+            write(wav * utilities.conversion.db_to_amp(dif),
+                  os.path.join(full_path, name + '.wav'),
+                  None, overall_gain)
 
         for name, wav in test_items.items():
             name = name.split('-')[0]
             if suffix:
                 name += suffix
-            write_wav(wav, os.path.join(full_path, name + '.wav'),
-                      target_loudness, overall_gain)
+            write(wav, os.path.join(full_path, name + '.wav'),
+                  target_loudness, overall_gain)
 
         for name in anchors._fields:
 
@@ -360,10 +537,26 @@ def write_target_from_sample(sample,
             if suffix:
                 name += suffix
 
-            write_wav(wav, os.path.join(full_path, name + '.wav'),
-                      target_loudness, overall_gain)
+            write(wav, os.path.join(full_path, name + '.wav'),
+                  target_loudness, overall_gain)
+
+        if manifest is not None:
+            manifest.record(key, inputs, track_parameters, outputs, idx)
 
 
+def track_seed(seed, track_id):
+    '''
+    Returns the seed of the anchors of a track: derived from `seed' and the
+    track id, so the random dropout differs between tracks but does not
+    depend on the order or selection of tracks.
+    '''
+
+    digest = hashlib.sha1('{0}/{1}'.format(seed, track_id).encode())
+
+    return int(digest.hexdigest()[:8], 16)
+
+
+@instrument.timed('write_wav')
 def write_wav(sig, filename, target_loudness=None, overall_gain=0):
 
     if target_loudness:
@@ -377,6 +570,7 @@ def write_wav(sig, filename, target_loudness=None, overall_gain=0):
     # If you need 32-bit wavs, use
     sig = sig.astype('float32')
     sig.write(filename)
+    instrument.record('write_wav', bytes_written=os.path.getsize(filename))
 
     return level_dif
 
@@ -390,8 +584,6 @@ def combine_anchors(distortion, artefact):
 def make_waves_same_length(list_of_waves):
 
     min_length = np.min([_.num_frames for _ in list_of_waves])
-    min_length = np.minimum(min_length,
-                            np.min([_.num_frames for _ in list_of_waves]))
 
     for i, wave in enumerate(list_of_waves):
         list_of_waves[i] = wave[:min_length]
@@ -399,7 +591,152 @@ def make_waves_same_length(list_of_waves):
     return list_of_waves
 
 
-def bss_eval(list_of_ref_waves, list_of_est_waves):
+def stack_waves(list_of_waves, dtype='float32', length=None, out=None):
+    '''
+    Copies the first channel of every wave into one contiguous array of
+    shape (waves, samples), trimmed to the shortest wave (and to `length'
+    if given).  This is the only copy made on the way to the metrics, which
+    take views (rows) of the returned array.
+
+    A preallocated `out' array that is large enough can be given to reuse
+    its memory; a view of it is returned.
+    '''
+
+    min_length = min(wave.shape[0] for wave in list_of_waves)
+    if length is not None:
+        min_length = min(min_length, length)
+
+    shape = (len(list_of_waves), min_length)
+    if out is None:
+        out = np.empty(shape, dtype)
+    elif out.shape[0] < shape[0] or out.shape[1] < shape[1]:
+        raise ValueError('out has to be at least of shape {}'.format(shape))
+    out = out[:shape[0], :shape[1]]
+
+    for row, wave in zip(out, list_of_waves):
+        samples = np.asarray(wave)
+        if samples.ndim > 1:
+            samples = samples[:, 0]
+        row[:] = samples[:min_length]
+
+    return out
+
+
+def stack_audio(audio, targets=None, dtype='float32'):
+    '''
+    Stacks the output of load_audio() (keys '<method>-<target>') into one
+    array of shape (methods, targets, samples), trimmed to the shortest
+    wave and averaged to mono.  Missing method/target combinations are NaN.
+
+    Returns the array and the lists of methods and targets.
+    '''
+
+    keys = [key.split('-', 1) for key in audio]
+    methods = sorted(set(method for method, _ in keys))
+    if targets is None:
+        targets = sorted(set(target for _, target in keys))
+
+    length = min(wave.shape[0] for wave in audio.values())
+    out = np.full((len(methods), len(targets), length), np.nan, dtype)
+
+    for (method, target), wave in zip(keys, audio.values()):
+        if target in targets:
+            out[methods.index(method), targets.index(target)] = (
+                np.asarray(wave[:length]).mean(1))
+
+    return out, methods, targets
+
+
+def _energy(x):
+    return np.einsum('...i,...i->...', x, x).astype('float64')
+
+
+def si_sdr(references, estimates):
+    '''
+    Scale-invariant signal to distortion ratio in dB over the last axis.
+    The arrays are broadcast, e.g. references of shape (sources, samples)
+    against estimates of shape (methods, sources, samples).
+    '''
+
+    alpha = (np.einsum('...i,...i->...', estimates, references) /
+             np.einsum('...i,...i->...', references, references))
+    target = alpha[..., np.newaxis] * references
+
+    with np.errstate(divide='ignore'):
+        return 10 * np.log10(_energy(target) / _energy(estimates - target))
+
+
+def snr(references, estimates):
+    '''
+    Signal to noise ratio in dB over the last axis, where the noise is the
+    difference between estimate and reference.  Broadcasts as si_sdr().
+    '''
+
+    with np.errstate(divide='ignore'):
+        return 10 * np.log10(_energy(references) /
+                             _energy(estimates - references))
+
+
+def energy_ratio(references, estimates):
+    '''
+    Energy of the estimate relative to the reference in dB over the last
+    axis.  Broadcasts as si_sdr().
+    '''
+
+    with np.errstate(divide='ignore'):
+        return 10 * np.log10(_energy(estimates) / _energy(references))
+
+
+def screening_metrics(references, estimates):
+    '''
+    Cheap screening of many estimates before running bss_eval() or
+    peass().  `references' and `estimates' are outputs of load_audio() for
+    the reference stems (method 'ref') and for the methods to screen.  An
+    accompaniment reference is formed from the non-vocal stems if needed.
+
+    All methods and targets are scored in one vectorised call.
+
+    Returns a DataFrame with the columns method, target, metric (SI-SDR,
+    SNR or energy_ratio) and score.
+    '''
+
+    ests, methods, targets = stack_audio(estimates)
+
+    refs = {key.split('-', 1)[1]: wave for key, wave in references.items()}
+    if 'accompaniment' in targets and 'accompaniment' not in refs:
+        refs['accompaniment'] = sum(wave for name, wave in refs.items()
+                                    if name != 'vocals')
+    refs = {'ref-' + target: refs[target] for target in targets}
+    refs, _, _ = stack_audio(refs, targets)
+
+    length = min(refs.shape[-1], ests.shape[-1])
+    refs = refs[0, :, :length]
+    ests = ests[..., :length]
+
+    # Skip targets a method does not provide
+    present = ~np.isnan(ests[..., 0]).ravel()
+
+    frames = []
+    for name, metric in [('SI-SDR', si_sdr),
+                         ('SNR', snr),
+                         ('energy_ratio', energy_ratio)]:
+        scores = metric(refs, ests)
+        frames.append(pd.DataFrame({
+            'method': np.repeat(methods, len(targets))[present],
+            'target': np.tile(targets, len(methods))[present],
+            'metric': name,
+            'score': scores.ravel()[present],
+        }))
+
+    return pd.concat(frames, ignore_index=True)
+
+
+@instrument.timed('bss_eval')
+def bss_eval(list_of_ref_waves,
+             list_of_est_waves,
+             cache=None,
+             engine='mir_eval',
+             dtype='float64'):
     '''
     This function computed the Bss Eval measures given the reference and
     estimated sources, both of which should be mono untwist.data.audio.Wave
@@ -407,6 +744,16 @@ def bss_eval(list_of_ref_waves, list_of_est_waves):
 
     You must give me a list of waves or 1 wave per argument.
 
+    If a cache.ResultCache is given as `cache', results are looked up there
+    first and stored after computing them.
+
+    `engine' is either 'mir_eval', 'numpy' (see BssEval) or a BssEval
+    instance of the (trimmed) references, to reuse it over many calls.
+
+    The waves are copied once into a single (sources, samples) array of
+    type `dtype' (see stack_waves()); 'float32' halves its memory and makes
+    the 'numpy' engine compute in single precision.
+
     Returns:
         BssEvalStats named tuple with the field names:
             - sdr: Signal to Distortion Ratio
@@ -415,8 +762,6 @@ def bss_eval(list_of_ref_waves, list_of_est_waves):
             - perm: Best ordering of estimated sources in the mean SIR sense
     '''
 
-    BssEvalStats = collections.namedtuple('BssEvalStats', 'sdr sir sar perm')
-
     if isinstance(list_of_ref_waves, data.audio.Wave):
         list_of_ref_waves = [list_of_ref_waves]
     if isinstance(list_of_est_waves, data.audio.Wave):
@@ -431,13 +776,257 @@ def bss_eval(list_of_ref_waves, list_of_est_waves):
 
     list_of_ref_waves[0].check_mono()
 
-    waves = make_waves_same_length(list_of_ref_waves + list_of_est_waves)
-    ref_sources = np.array([_[:, 0] for _ in waves[:num_sources]])
-    est_sources = np.array([_[:, 0] for _ in waves[num_sources:]])
+    waves = list_of_ref_waves + list_of_est_waves
+    sources = stack_waves(waves, dtype)
+    ref_sources = sources[:num_sources]
+    est_sources = sources[num_sources:]
+
+    if cache is not None:
+        # Keyed by the trimmed waves (views, no copy)
+        waves = [wave[:sources.shape[1]] for wave in waves]
+        # Defaults (mir_eval, float64) are left out, which keeps their keys
+        parameters = {}
+        if engine != 'mir_eval':
+            parameters['engine'] = 'numpy'
+        if sources.dtype != np.float64:
+            parameters['dtype'] = sources.dtype.name
+        key = cache.key('bss_eval',
+                        waves[:num_sources],
+                        waves[num_sources:],
+                        parameters or None)
+        stored = cache.get(key)
+        if stored is not None:
+            return BssEvalStats(**{name: np.array(value)
+                                   for name, value in stored.items()})
+
+    if engine == 'mir_eval':
+
+        from mir_eval import separation
+        (sdr, sir, sar, perm) = separation.bss_eval_sources(ref_sources,
+                                                            est_sources,
+                                                            False)
+
+        stats = BssEvalStats(sdr=sdr,
+                             sir=sir,
+                             sar=sar,
+                             perm=perm)
+    else:
+
+        if not isinstance(engine, BssEval):
+            engine = BssEval(ref_sources, dtype=ref_sources.dtype)
+        stats = engine.evaluate(est_sources)
+
+    if cache is not None:
+        cache.put(key, stats._asdict())
+
+    return stats
+
+
+class BssEval:
+    '''
+    NumPy implementation of the Bss Eval source measures (as computed by
+    mir_eval.separation.bss_eval_sources without permutation), which
+    does all the work depending only on the references once.  The
+    references' spectra, the Gram matrix of their delayed versions and its
+    factorisation are computed on construction; evaluate() then only needs
+    the cross-correlations with the estimates and back substitution.  This
+    pays off when many methods are scored against the same references.
+
+        engine = BssEval(reference_sources)
+        for estimated_sources in methods:
+            stats = engine.evaluate(estimated_sources)
+
+    reference_sources:
+        Array of shape (sources, samples).
+    filter_length:
+        Length of the distortion filters (512 as in mir_eval).
+    dtype:
+        Precision of the FFTs, 'float64' or 'float32'.  The linear systems
+        are always solved in double precision.
+    '''
+
+    def __init__(self, reference_sources, filter_length=512, dtype='float64'):
+
+        from scipy import fft, linalg
+
+        refs = np.asarray(reference_sources, dtype=dtype)
+        num_sources, num_samples = refs.shape
+        flen = filter_length
+
+        self.references = refs
+        self.filter_length = flen
+        self.num_samples = num_samples
+        self.n_fft = int(2 ** np.ceil(np.log2(num_samples + flen - 1.)))
+        self.sf = fft.rfft(refs, self.n_fft, axis=1)
+
+        # Inner products between delayed versions of the references
+        gram = np.zeros((num_sources * flen, num_sources * flen))
+        for i in range(num_sources):
+            for j in range(i, num_sources):
+                ssf = fft.irfft(self.sf[i] * np.conj(self.sf[j]), self.n_fft)
+                ss = linalg.toeplitz(np.hstack((ssf[0], ssf[-1:-flen:-1])),
+                                     r=ssf[:flen])
+                gram[i * flen:(i + 1) * flen, j * flen:(j + 1) * flen] = ss
+                gram[j * flen:(j + 1) * flen, i * flen:(i + 1) * flen] = ss.T
+
+        # Projection onto all references and onto each reference alone
+        self._solve_all = self._solver(gram)
+        self._solve_each = []
+        for i in range(num_sources):
+            block = slice(i * flen, (i + 1) * flen)
+            self._solve_each.append(self._solver(gram[block, block]))
+
+    @staticmethod
+    def _solver(matrix):
+        '''
+        Returns a function solving matrix * x = b, using a Cholesky
+        factorisation or least squares if the matrix is singular.
+        '''
+
+        from scipy import linalg
+
+        try:
+            factor = linalg.cho_factor(matrix)
+            return lambda b: linalg.cho_solve(factor, b)
+        except linalg.LinAlgError:
+            return lambda b: linalg.lstsq(matrix, b)[0]
+
+    def _filter(self, coefficients, sources):
+        '''
+        Sum of the references `sources` filtered by `coefficients` (one row
+        per reference), of length samples + filter_length - 1.
+        '''
+
+        from scipy import fft
+
+        spectrum = (fft.rfft(coefficients, self.n_fft, axis=1) *
+                    self.sf[sources]).sum(0)
+
+        length = self.num_samples + self.filter_length - 1
+
+        return fft.irfft(spectrum, self.n_fft)[:length]
+
+    def evaluate(self, estimated_sources):
+        '''
+        Returns the BssEvalStats of the estimates (an array of shape
+        (sources, samples), in the order of the references).
+        '''
+
+        from scipy import fft
+
+        ests = np.asarray(estimated_sources, dtype=self.references.dtype)
+        num_sources = len(self.references)
+        flen = self.filter_length
+
+        if ests.shape != self.references.shape:
+            raise ValueError('The estimates have to be of shape {}'.format(
+                self.references.shape))
+
+        # Inner products between the estimates and delayed references
+        products = np.empty((num_sources, num_sources, flen))
+        for j, est in enumerate(ests):
+            sef = fft.rfft(est, self.n_fft)
+            ssef = fft.irfft(self.sf * np.conj(sef), self.n_fft, axis=1)
+            products[j] = np.hstack((ssef[:, :1], ssef[:, -1:-flen:-1]))
+
+        # Distortion filters for all estimates at once
+        coefficients = self._solve_all(
+            products.reshape(num_sources, -1).T).T.reshape(products.shape)
+
+        sdr = np.empty(num_sources)
+        sir = np.empty(num_sources)
+        sar = np.empty(num_sources)
 
-    (sdr, sir, sar, perm) = separation.bss_eval_sources(ref_sources,
-                                                        est_sources,
-                                                        False)
+        for j, est in enumerate(ests):
+
+            # Projections onto the target and onto all references
+            single = self._solve_each[j](products[j, j])
+            s_filt = self._filter(single[np.newaxis], [j])
+            sproj = self._filter(coefficients[j], slice(None))
+
+            e_interf = sproj - s_filt
+            e_artif = -sproj
+            e_artif[:self.num_samples] += est
+
+            sdr[j] = _safe_db(np.sum(s_filt ** 2),
+                              np.sum((e_interf + e_artif) ** 2))
+            sir[j] = _safe_db(np.sum(s_filt ** 2), np.sum(e_interf ** 2))
+            sar[j] = _safe_db(np.sum(sproj ** 2), np.sum(e_artif ** 2))
+
+        return BssEvalStats(sdr=sdr,
+                            sir=sir,
+                            sar=sar,
+                            perm=np.arange(num_sources))
+
+
+def _safe_db(num, den):
+    '''
+    Energy ratio in dB, infinite if there is nothing in the denominator.
+    '''
+
+    if den == 0:
+        return np.inf
+    return 10 * np.log10(num / den)
+
+
+def bss_eval_framewise(list_of_refs,
+                       list_of_ests,
+                       window=44100,
+                       hop=44100,
+                       engine='numpy'):
+    '''
+    Computes the Bss Eval measures on successive windows of the signals, as
+    in the SiSEC framewise protocol (by default windows and hops of 1 s at
+    44.1 kHz).  References and estimates can be given as wav file paths,
+    which are memory-mapped and read one window at a time, or as mono
+    waves.  Multichannel files are averaged to mono.  Memory use therefore
+    only depends on the window length.
+
+    Frames in which any reference or estimate is silent are set to NaN, as
+    in mir_eval.separation.bss_eval_sources_framewise.  `engine' is
+    'numpy' (BssEval) or 'mir_eval'.
+
+    Returns:
+        BssEvalStats named tuple with arrays of shape (sources, frames).
+    '''
+
+    if isinstance(list_of_refs, (str, data.audio.Wave)):
+        list_of_refs = [list_of_refs]
+    if isinstance(list_of_ests, (str, data.audio.Wave)):
+        list_of_ests = [list_of_ests]
+
+    num_sources = len(list_of_refs)
+    if len(list_of_ests) != num_sources:
+        raise ValueError('The number of reference and estimates sources is '
+                         'not equal')
+
+    signals = [_open_samples(source) for source in list_of_refs + list_of_ests]
+    num_samples = min(len(samples) for samples in signals)
+    num_frames = max(int(np.floor((num_samples - window + hop) / hop)), 0)
+
+    sdr = np.full((num_sources, num_frames), np.nan)
+    sir = np.full((num_sources, num_frames), np.nan)
+    sar = np.full((num_sources, num_frames), np.nan)
+    perm = np.tile(np.arange(num_sources)[:, np.newaxis], (1, num_frames))
+
+    for k in range(num_frames):
+
+        frame = slice(k * hop, k * hop + window)
+        refs = np.array([_mono_float(samples[frame])
+                         for samples in signals[:num_sources]])
+        ests = np.array([_mono_float(samples[frame])
+                         for samples in signals[num_sources:]])
+
+        if (~refs.any(1)).any() or (~ests.any(1)).any():
+            continue
+
+        if engine == 'mir_eval':
+            from mir_eval import separation
+            stats = separation.bss_eval_sources(refs, ests, False)
+        else:
+            stats = BssEval(refs).evaluate(ests)
+
+        sdr[:, k], sir[:, k], sar[:, k] = stats[:3]
 
     return BssEvalStats(sdr=sdr,
                         sir=sir,
@@ -445,37 +1034,203 @@ def bss_eval(list_of_ref_waves, list_of_est_waves):
                         perm=perm)
 
 
-def peass(list_of_ref_waves, list_of_est_waves, path_to_peass_toolbox):
+def _open_samples(source):
     '''
-    This function computed the Bss Eval measures given the reference and
+    Returns the samples of a wav file path (memory-mapped) or a wave.
+    '''
+
+    if isinstance(source, str):
+        from scipy.io import wavfile
+        sample_rate, samples = wavfile.read(source, mmap=True)
+        return samples
+
+    return np.asarray(source)
+
+
+def _mono_float(samples):
+    '''
+    Converts a block of (possibly integer, multichannel) samples to a mono
+    float64 array.
+    '''
+
+    if np.issubdtype(samples.dtype, np.integer):
+        samples = samples / float(np.iinfo(samples.dtype).max)
+    else:
+        samples = np.asarray(samples, dtype='float64')
+
+    if samples.ndim > 1:
+        samples = samples.mean(1)
+
+    return samples
+
+
+def bss_eval_sample(sample,
+                    force_mono=True,
+                    start=None,
+                    end=None,
+                    workers=1,
+                    cache=None,
+                    engine='mir_eval'):
+    '''
+    Computes the Bss Eval measures for every method in a sample DataFrame
+    (e.g. from data.get_sample()), which has to include the references
+    (method 'ref').  The tracks are scored in a pool of `workers`
+    processes, each of which loads the references of its track once.  Only
+    the rows of the sample are sent to the workers, not the audio.
+
+    Each method is evaluated on all of its targets at once.  If a method
+    provides an accompaniment, its reference is the sum of the non-vocal
+    reference stems.  `start' and `end' select a segment (in samples) as
+    for load_audio().
+
+    With engine='numpy', all methods of a track with the same targets are
+    scored in one task, reusing one BssEval of the references.
+
+    Returns a DataFrame in the layout of the SiSEC results (see
+    data.get_sisec_df()), with one row per track, method, target and
+    metric (SDR, SIR, SAR and perm).
+    '''
+
+    tasks = [(g_sample, force_mono, start, end, cache, engine)
+             for _, g_sample in sample.groupby('track_id')]
+
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(instrument.call_collected,
+                                        repeat(_bss_eval_track), tasks))
+        frames = []
+        for track_frames, stats in results:
+            instrument.add(stats)
+            frames.append(track_frames)
+    else:
+        frames = [_bss_eval_track(task) for task in tasks]
+
+    frames = [frame for track_frames in frames for frame in track_frames]
+
+    if not frames:
+        return pd.DataFrame(columns=sample.columns)
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def _bss_eval_track(task):
+    '''
+    Scores all methods of one track, see bss_eval_sample().  The references
+    are loaded (and the accompaniment reference is summed) once, in the
+    process scoring the track.  Returns a list of DataFrames.
+    '''
+
+    g_sample, force_mono, start, end, cache, engine = task
+    track_id = g_sample['track_id'].iloc[0]
+
+    frames = []
+    for _, g_sample in instrument.tracks([(track_id, g_sample)]):
+
+        ref_sample = g_sample[g_sample.method == 'ref']
+        refs = load_audio(ref_sample, force_mono, start, end)
+        refs = {key.split('-')[1]: wave for key, wave in refs.items()}
+
+        # Methods with the same references, scored together
+        groups = {}
+
+        not_ref_sample = g_sample[g_sample.method != 'ref']
+        for method_name, method_sample in not_ref_sample.groupby('method'):
+
+            method_sample = method_sample.drop_duplicates('target')
+
+            for target in method_sample.target:
+                if target == 'accompaniment' and target not in refs:
+                    refs[target] = sum(wave for name, wave in refs.items()
+                                       if name != 'vocals')
+                elif target not in refs:
+                    raise ValueError(
+                        'No reference for {0} in track {1}'.format(target,
+                                                                   track_id))
+
+            if engine == 'numpy':
+                group_key = tuple(method_sample.target)
+            else:
+                group_key = method_name
+
+            groups.setdefault(group_key, []).append(method_sample)
+
+        for method_samples in groups.values():
+            ref_waves = [refs[target] for target in method_samples[0].target]
+            frames.extend(_bss_eval_methods(method_samples, ref_waves,
+                                            force_mono, start, end, cache,
+                                            engine))
+
+    return frames
+
+
+def _bss_eval_methods(method_samples, ref_waves, force_mono, start, end,
+                      cache, engine):
+    '''
+    Scores the estimates of methods of a track against the same
+    references, see bss_eval_sample().  Returns a list of DataFrames.
+    '''
+
+    frames = []
+    for method_sample in method_samples:
+
+        ests = load_audio(method_sample, force_mono, start, end)
+        est_waves = [ests['{0}-{1}'.format(row.method, row.target)]
+                     for row in method_sample.itertuples()]
+
+        # Build the engine once for all methods with the same length
+        if engine == 'numpy' or isinstance(engine, BssEval):
+            length = min(wave.num_frames for wave in ref_waves + est_waves)
+            if (not isinstance(engine, BssEval) or
+                    engine.num_samples != length):
+                engine = BssEval(stack_waves(ref_waves, 'float64', length))
+
+        stats = bss_eval(list(ref_waves), est_waves, cache, engine)
+
+        rows = []
+        for metric in ['SDR', 'SIR', 'SAR', 'perm']:
+            scores = method_sample.copy()
+            scores['metric'] = metric
+            scores['score'] = getattr(stats, metric.lower())
+            rows.append(scores)
+
+        frames.append(pd.concat(rows, ignore_index=True))
+
+    return frames
+
+
+@instrument.timed('peass')
+def peass(list_of_ref_waves,
+          list_of_est_waves,
+          path_to_peass_toolbox=None,
+          pool=None,
+          cache=None,
+          in_memory=False):
+    '''
+    This function computes the PEASS measures given the reference and
     estimated sources, both of which should be mono untwist.data.audio.Wave
     objects. I will trim the end of your audio if they are not equal in length.
 
     You must give me a list of waves or 1 wave per argument.
 
-    Returns:
-        BssEvalStats named tuple with the field names:
-            - sdr: Signal to Distortion Ratio
-            - sir: Signal to Interference Ratio
-            - sar: Signal to Artefacts Ratio
-            - perm: Best ordering of estimated sources in the mean SIR sense
-    '''
+    Either give the path to the PEASS toolbox, which starts a new MATLAB
+    session, or a sessions.MatlabPool to take a warm session from.
 
-    main_script = '''
-        options.segmentationFactor = 1;
-        res = PEASS_ObjectiveMeasure(refFiles, estimateFile, options);
-        ops = res.OPS;
-        tps = res.TPS;
-        ips = res.IPS;
-        aps = res.APS;
-        '''
+    If a cache.ResultCache is given as `cache', only estimates that are not
+    in the cache are evaluated.
 
-    StatsPEASS = collections.namedtuple('StatsPEASS', ['ops',
-                                                       'tps',
-                                                       'ips',
-                                                       'aps',
-                                                       ]
-                                        )
+    With `in_memory', the audio is passed to MATLAB with put() instead of
+    being written to wav files by Python, and the files PEASS needs (its
+    API only takes file names) as well as its intermediate files are kept
+    in config.ram_dir (a tmpfs such as /dev/shm).
+
+    Returns:
+        StatsPEASS named tuple with the field names:
+            - ops: Overall Perceptual Score
+            - tps: Target-related Perceptual Score
+            - ips: Interference-related Perceptual Score
+            - aps: Artifact-related Perceptual Score
+    '''
 
     # Initial setup for dealing with waves
     if isinstance(list_of_ref_waves, data.audio.Wave):
@@ -496,28 +1251,91 @@ def peass(list_of_ref_waves, list_of_est_waves, path_to_peass_toolbox):
     refs = waves[:num_sources]
     ests = waves[num_sources:]
 
-    # Matlab side... (yak!)
-    matlab = matlab_wrapper.MatlabSession()
-    matlab.eval("addpath(genpath('{}'));".format(path_to_peass_toolbox))
+    stats = [None] * num_sources
+    if cache is not None:
+        keys = [_peass_key(cache, refs, i, est) for i, est in enumerate(ests)]
+        stored = cache.get_many(keys)
+        for i, key in enumerate(keys):
+            if key in stored:
+                stats[i] = StatsPEASS(**stored[key])
 
-    with TemporaryDirectory() as tmp_dir:
+    indices = [i for i, stat in enumerate(stats) if stat is None]
+
+    if indices:
+        if pool is None:
+            matlab = sessions.start_session(path_to_peass_toolbox)
+            new_stats = _peass(matlab, refs, ests, indices, in_memory)
+        else:
+            new_stats = pool.run(_peass, refs, ests, indices, in_memory)
+
+        for i, stat in zip(indices, new_stats):
+            stats[i] = stat
+
+        if cache is not None:
+            cache.put_many({keys[i]: stats[i]._asdict() for i in indices})
+
+    if len(stats) == 1:
+        return stats[0]
+    else:
+        return stats
+
+
+def _peass_key(cache, refs, i, est):
+    '''
+    Cache key of the PEASS measures of estimate `est` of source `i`.
+    '''
+
+    return cache.key('peass',
+                     [refs[i]] + refs[:i] + refs[i + 1:],
+                     [est],
+                     PEASS_OPTIONS)
+
+
+def _peass(matlab, refs, ests, indices=None, in_memory=False):
+    '''
+    Runs PEASS in the given MATLAB session for the estimates at `indices`
+    (default all) and returns a list of StatsPEASS.  See peass() for
+    `in_memory`.
+    '''
+
+    if indices is None:
+        indices = range(len(ests))
+
+    main_script = '''
+        options.segmentationFactor = {segmentationFactor};
+        res = PEASS_ObjectiveMeasure(refFiles, estimateFile, options);
+        ops = res.OPS;
+        tps = res.TPS;
+        ips = res.IPS;
+        aps = res.APS;
+        '''.format(**PEASS_OPTIONS)
+
+    # Written as 32 bit float, so MATLAB neither clips nor quantises
+    write_script = '''
+        audiowrite(estimateFile, estimateSignal, fs, 'BitsPerSample', 32);
+        '''
+
+    with TemporaryDirectory(dir=_ram_dir() if in_memory else None) as tmp_dir:
 
         # First we need to write the reference source to disk
-        for i, wave in enumerate(refs):
-            name = '{}/{}.wav'.format(tmp_dir, i)
-            wave.write(name)
-            if i == 0:
-                cell = "{{'{0}'".format(name)
-            else:
-                cell = "{0};'{1}'".format(cell, name)
-        cell += '}'
+        names = ['{}/{}.wav'.format(tmp_dir, i) for i in range(len(refs))]
+
+        if in_memory:
+            matlab.put('fs', float(refs[0].sample_rate))
+            for name, wave in zip(names, refs):
+                matlab.put('estimateFile', name)
+                matlab.put('estimateSignal', np.asarray(wave, 'float64'))
+                matlab.eval(write_script)
+        else:
+            for name, wave in zip(names, refs):
+                wave.write(name)
 
-        matlab.eval('originalFiles = {};'.format(cell))
+        matlab.eval('originalFiles = {};'.format(_matlab_cell(names)))
         matlab.eval("options.destDir = '{}'".format(tmp_dir))
 
         # Now run PEASS on the estimated sources
         stats = []
-        for i, wave in enumerate(ests):
+        for i in indices:
 
             organised_files = (
                 "refFiles = "
@@ -527,10 +1345,14 @@ def peass(list_of_ref_waves, list_of_est_waves, path_to_peass_toolbox):
             matlab.eval(organised_files)
 
             name = '{}/est.wav'.format(tmp_dir)
-            wave.write(name)
-
             matlab.put('estimateFile', name)
 
+            if in_memory:
+                matlab.put('estimateSignal', np.asarray(ests[i], 'float64'))
+                matlab.eval(write_script)
+            else:
+                ests[i].write(name)
+
             matlab.eval(main_script)
 
             stats.append(
@@ -540,7 +1362,199 @@ def peass(list_of_ref_waves, list_of_est_waves, path_to_peass_toolbox):
                            aps=matlab.get('aps'))
             )
 
-    if len(stats) == 1:
-        return stats[0]
-    else:
-        return stats
+    return stats
+
+
+def _ram_dir():
+    '''
+    Returns config.ram_dir if it exists, otherwise None (the default
+    temporary directory).
+    '''
+
+    if config.ram_dir and os.path.isdir(config.ram_dir):
+        return config.ram_dir
+    return None
+
+
+def _matlab_cell(items):
+    '''
+    Returns a MATLAB column cell array literal of the given strings.
+    '''
+
+    return '{' + ';'.join("'{}'".format(item) for item in items) + '}'
+
+
+def peass_many(items,
+               path_to_peass_toolbox=None,
+               pool=None,
+               size=4,
+               cache=None,
+               in_memory=False):
+    '''
+    Runs peass() on many (list_of_ref_waves, list_of_est_waves) pairs
+    concurrently, one per session of a sessions.MatlabPool.  If no pool is
+    given, one with `size` sessions is started (and closed afterwards).
+    `cache` and `in_memory` are passed on to peass().
+
+    Returns a list with the result of peass() for every item.
+    '''
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    own_pool = pool is None
+    if own_pool:
+        pool = sessions.MatlabPool(path_to_peass_toolbox, size)
+
+    try:
+        with ThreadPoolExecutor(pool.size) as executor:
+            return list(executor.map(
+                lambda item: peass(item[0], item[1], pool=pool,
+                                   cache=cache, in_memory=in_memory),
+                items))
+    finally:
+        if own_pool:
+            pool.close()
+
+
+def peass_batch(items,
+                path_to_peass_toolbox=None,
+                pool=None,
+                cache=None,
+                in_memory=False):
+    '''
+    Computes the PEASS measures for many tracks in one go.  All references
+    and estimates are written to disk once and a single MATLAB loop
+    evaluates every estimate, instead of one round trip per estimate as in
+    peass().
+
+    items:
+        Dictionary mapping a track id to a tuple of
+        (list_of_ref_waves, list_of_est_waves), see peass().
+    path_to_peass_toolbox, pool:
+        As for peass().
+    cache:
+        Optional cache.ResultCache.  Cached estimates are looked up in bulk
+        and only the others are written and evaluated.
+    in_memory:
+        Keep all audio and intermediate PEASS files in config.ram_dir (a
+        tmpfs such as /dev/shm).  The audio is still written by Python, as
+        one batch of files.
+
+    Returns a DataFrame with the columns track_id, source (index of the
+    estimate in its list), ops, tps, ips and aps.
+    '''
+
+    # Trim every track and find the estimates that need evaluating
+    tracks = {}
+    for track_id, (list_of_ref_waves, list_of_est_waves) in items.items():
+
+        if isinstance(list_of_ref_waves, data.audio.Wave):
+            list_of_ref_waves = [list_of_ref_waves]
+        if isinstance(list_of_est_waves, data.audio.Wave):
+            list_of_est_waves = [list_of_est_waves]
+
+        num_sources = len(list_of_ref_waves)
+        if len(list_of_est_waves) != num_sources:
+            raise ValueError(
+                'The number of reference and estimates sources is not '
+                'equal for track {}'.format(track_id))
+
+        list_of_ref_waves[0].check_mono()
+
+        tracks[track_id] = make_waves_same_length(list_of_ref_waves +
+                                                  list_of_est_waves)
+
+    index = [(track_id, i)
+             for track_id, waves in tracks.items()
+             for i in range(len(waves) // 2)]
+
+    stats = {}
+    if cache is not None:
+        keys = {}
+        for track_id, i in index:
+            waves = tracks[track_id]
+            num_sources = len(waves) // 2
+            keys[track_id, i] = _peass_key(cache,
+                                           waves[:num_sources],
+                                           i,
+                                           waves[num_sources + i])
+        stored = cache.get_many(keys.values())
+        for item, key in keys.items():
+            if key in stored:
+                stats[item] = StatsPEASS(**stored[key])
+
+    missing = [item for item in index if item not in stats]
+
+    ref_files = []
+    est_files = []
+    dest_dirs = []
+
+    with TemporaryDirectory(dir=_ram_dir() if in_memory else None) as tmp_dir:
+
+        written = {}
+        for track_id, i in missing:
+
+            waves = tracks[track_id]
+            num_sources = len(waves) // 2
+
+            # Write the audio of every track only once
+            if track_id not in written:
+                track_dir = os.path.join(tmp_dir, str(len(written)))
+                os.makedirs(track_dir)
+                names = []
+                for j, wave in enumerate(waves):
+                    name = os.path.join(track_dir, '{}.wav'.format(j))
+                    wave.write(name)
+                    names.append(name)
+                written[track_id] = (track_dir, names)
+
+            track_dir, names = written[track_id]
+            refs = names[:num_sources]
+
+            # The target has to come first
+            ref_files.append(
+                _matlab_cell([refs[i]] + refs[:i] + refs[i + 1:]))
+            est_files.append(names[num_sources + i])
+            dest_dirs.append(track_dir)
+
+        script = '''
+            refFiles = {{{0}}};
+            estFiles = {1};
+            destDirs = {2};
+            options.segmentationFactor = {segmentationFactor};
+            results = zeros(numel(estFiles), 4);
+            for k = 1:numel(estFiles)
+                options.destDir = destDirs{{k}};
+                res = PEASS_ObjectiveMeasure(refFiles{{k}}, estFiles{{k}}, ...
+                                             options);
+                results(k, :) = [res.OPS, res.TPS, res.IPS, res.APS];
+            end
+            '''.format(','.join(ref_files),
+                       _matlab_cell(est_files),
+                       _matlab_cell(dest_dirs),
+                       **PEASS_OPTIONS)
+
+        def run(matlab):
+            matlab.eval(script)
+            return matlab.get('results')
+
+        if missing:
+            if pool is None:
+                results = run(sessions.start_session(path_to_peass_toolbox))
+            else:
+                results = pool.run(run)
+
+            results = np.reshape(results, (-1, 4))
+            for item, row in zip(missing, results):
+                stats[item] = StatsPEASS(*row)
+
+            if cache is not None:
+                cache.put_many({keys[item]: stats[item]._asdict()
+                                for item in missing})
+
+    df = pd.DataFrame([stats[item] for item in index],
+                      columns=StatsPEASS._fields)
+    df.insert(0, 'source', [source for _, source in index])
+    df.insert(0, 'track_id', [track_id for track_id, _ in index])
+
+    return df
@@ -0,0 +1,230 @@
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import sqlite3
+import numpy as np
+from untwist import data
+from .anchor import Anchors
+
+
+def hash_waves(*waves):
+    '''
+    Returns a hex digest of the content of the given waves (or arrays),
+    including their shape, data type and sample rate.  None is allowed
+    and hashes differently from any audio.
+    '''
+
+    sha = hashlib.sha1()
+    for wave in waves:
+        if wave is None:
+            sha.update(b'None')
+            continue
+        samples = np.ascontiguousarray(wave)
+        sha.update('{0}{1}{2}'.format(samples.dtype.str,
+                                      samples.shape,
+                                      getattr(wave, 'sample_rate', None)
+                                      ).encode())
+        sha.update(samples.data)
+
+    return sha.hexdigest()
+
+
+def hash_parameters(parameters):
+    '''
+    Returns a hex digest of a dictionary of (JSON serialisable) parameters.
+    '''
+
+    text = json.dumps(parameters, sort_keys=True, default=str)
+
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class AnchorCache:
+    '''
+    On-disk cache of the anchors created by anchor.Anchor or
+    anchor.RemixAnchor.  Entries are keyed by the content of the target and
+    background audio, the anchor parameters and the random seed, because
+    anchors are only reproducible for a fixed seed.
+
+    Every entry is a .npz file in `directory`.  When the total size exceeds
+    `max_size` bytes, the least recently used entries are removed.
+    '''
+
+    def __init__(self, directory, max_size=2 * 1024 ** 3):
+
+        self.directory = directory
+        self.max_size = max_size
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def key(self, creator, seed):
+        '''
+        Returns the cache key for the anchors of `creator` (an Anchor or
+        RemixAnchor instance) created after seeding numpy with `seed`.
+        '''
+
+        return hash_parameters({
+            'audio': hash_waves(creator.target, creator.background),
+            'parameters': creator.parameters,
+            'seed': seed,
+        })
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        '''
+        Returns the cached Anchors for `key` or None.
+        '''
+
+        filename = self._filename(key)
+        if not os.path.exists(filename):
+            return None
+
+        with np.load(filename) as stored:
+            sample_rate = int(stored['sample_rate'])
+            anchors = Anchors(*[data.audio.Wave(stored[name], sample_rate)
+                                for name in Anchors._fields])
+
+        # Mark as recently used
+        os.utime(filename, None)
+
+        return anchors
+
+    def put(self, key, anchors):
+        '''
+        Stores `anchors` (an Anchors named tuple of waves) under `key`.
+        '''
+
+        filename = self._filename(key)
+        tmp_filename = filename + '.tmp.npz'
+
+        np.savez(tmp_filename,
+                 sample_rate=anchors.Distortion.sample_rate,
+                 **{name: np.asarray(getattr(anchors, name))
+                    for name in Anchors._fields})
+        os.replace(tmp_filename, filename)
+
+        self.evict()
+
+    def evict(self):
+        '''
+        Removes the least recently used entries until the cache is no larger
+        than `max_size`.
+        '''
+
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz') and '.tmp' not in entry.name:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        '''
+        Removes all entries.
+        '''
+
+        max_size = self.max_size
+        self.max_size = -1
+        self.evict()
+        self.max_size = max_size
+
+
+class ResultCache:
+    '''
+    On-disk cache of objective metrics such as audio.bss_eval() and
+    audio.peass(), which are deterministic given the audio.  Entries are
+    keyed by the name of the metric, hashes of the (trimmed) reference and
+    estimate audio and the metric parameters, and stored as JSON in an
+    SQLite database, so many entries can be looked up or inserted at once.
+    '''
+
+    def __init__(self, filename):
+
+        self.filename = filename
+
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS results '
+                       '(key TEXT PRIMARY KEY, value TEXT)')
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.filename, timeout=60)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def key(self, metric, references, estimates, parameters=None):
+        '''
+        Returns the cache key for `metric` computed on the given lists of
+        reference and estimate waves with `parameters` (a dictionary).
+        '''
+
+        return hash_parameters({
+            'metric': metric,
+            'references': hash_waves(*references),
+            'estimates': hash_waves(*estimates),
+            'parameters': parameters,
+        })
+
+    def get_many(self, keys):
+        '''
+        Returns a dictionary of the cached values for those of `keys` that
+        are in the cache.
+        '''
+
+        keys = list(keys)
+        found = {}
+
+        with self._connect() as db:
+            # Stay below SQLite's limit of host parameters per statement
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = db.execute(
+                    'SELECT key, value FROM results WHERE key IN ({})'.format(
+                        ','.join('?' * len(chunk))),
+                    chunk)
+                for key, value in rows:
+                    found[key] = json.loads(value)
+
+        return found
+
+    def put_many(self, items):
+        '''
+        Stores a dictionary of key -> value, where values are JSON
+        serialisable (numpy arrays and scalars are converted).
+        '''
+
+        def convert(value):
+            if isinstance(value, (np.ndarray, np.generic)):
+                return value.tolist()
+            raise TypeError(repr(value))
+
+        with self._connect() as db:
+            db.executemany(
+                'INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)',
+                [(key, json.dumps(value, default=convert))
+                 for key, value in items.items()])
+
+    def get(self, key):
+        '''
+        Returns the cached value for `key` or None.
+        '''
+        return self.get_many([key]).get(key)
+
+    def put(self, key, value):
+        '''
+        Stores `value` under `key`.
+        '''
+        self.put_many({key: value})
@@ -0,0 +1,279 @@
+'''
+Builds a listening test from a YAML spec: sample selection, stimulus
+writing and MUSHRA config generation.
+
+    masseval spec.yaml --workers 8
+    masseval spec.yaml --stages mixtures mushra
+
+An example spec, every stage is optional and takes the keyword arguments of
+the function it runs:
+
+    config:                 # attributes of masseval.config
+      mus_base_path: /data/MUS2017
+      dsd_base_path: /data/DSD100
+      mushra_config_file: mushra.yaml
+    output: /scratch/test   # default directory of all stages
+    selection:              # data.get_sample(), once per entry
+      seed: 0
+      exclude_used_tracks: true
+      samples:
+        - {num_tracks: 2, num_algos: 4, metric: SDR, target: vocals}
+        - {num_tracks: 2, num_algos: 4, metric: SAR, target: vocals}
+    mixtures:               # audio.write_mixtures_from_sample()
+      target: vocals
+      mixing_levels: [0, 6, 12]
+    targets:                # audio.write_target_from_sample()
+      target: vocals
+      seed: 0
+      stft_backend: scipy   # anchors in float32
+      block_size: 256       # STFT frames per block, bounds the memory
+    mushra:                 # mushra.mixture_from_track_sample()
+      mixing_levels: [0, 6, 12]
+
+The selection is saved as sample.csv in the output directory, where the
+other stages read it from, so they can be run separately.
+'''
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from . import config
+from . import instrument
+
+stages = ['selection', 'mixtures', 'targets', 'mushra']
+
+# Stages writing stimuli, run per track
+track_stages = {
+    'mixtures': 'write_mixtures_from_sample',
+    'targets': 'write_target_from_sample',
+}
+
+
+def read_spec(filename):
+    '''
+    Returns the spec in a YAML file as a dictionary.
+    '''
+
+    with open(filename) as file:
+        spec = yaml.safe_load(file)
+
+    unknown = set(spec) - set(stages) - {'config', 'output'}
+    if unknown:
+        raise ValueError('Unknown entries in spec: {}'.format(
+            ', '.join(sorted(unknown))))
+
+    return spec
+
+
+def configure(settings):
+    '''
+    Sets the attributes of masseval.config given in `settings'.
+    '''
+
+    for name, value in (settings or {}).items():
+        if not hasattr(config, name):
+            raise ValueError('Unknown config entry: {}'.format(name))
+        setattr(config, name, value)
+
+
+def select(spec):
+    '''
+    Runs get_sample() for every entry of spec['samples'] and returns the
+    combined sample.  Tracks of earlier entries are excluded from later ones
+    if spec['exclude_used_tracks'] is set.
+    '''
+
+    from . import data
+
+    if spec.get('seed') is not None:
+        np.random.seed(spec['seed'])
+
+    df = data.get_sisec_df()
+
+    exclude_tracks = []
+    samples = []
+    for options in spec['samples']:
+        options = dict(options)
+        if spec.get('exclude_used_tracks', True):
+            options['exclude_tracks'] = exclude_tracks + list(
+                options.get('exclude_tracks', []))
+        sample = data.get_sample(df, **options)
+        exclude_tracks += list(sample['track_id'].unique())
+        samples.append(sample)
+
+    return pd.concat(samples)
+
+
+def _run_track(task):
+    '''
+    Writes the stimuli of one track, in a worker process.  Returns the
+    seconds it took and the instrument.Stats of the track.
+    '''
+
+    from . import audio
+
+    function, track_sample, options, settings = task
+    configure(settings)
+    start = time.time()
+    _, stats = instrument.call_collected(getattr(audio, function),
+                                         track_sample, **options)
+
+    return time.time() - start, stats
+
+
+def write_per_track(stage, sample, options, settings, workers=1,
+                    progress=None):
+    '''
+    Runs the writer of `stage' on every track of `sample', in parallel if
+    workers > 1.  progress(done, total, track_id, seconds) is called after
+    each track.  If `options' select a shard, only its tracks are run.
+    '''
+
+    from .manifest import select_shard
+
+    sample = select_shard(sample, options.get('shard'),
+                          options.get('num_shards'))
+    tasks = [(track_stages[stage], track_sample, options, settings)
+             for _, track_sample in sample.groupby('track_id')]
+    track_ids = [track_sample['track_id'].iloc[0]
+                 for _, track_sample, _, _ in tasks]
+
+    def report(done, index, seconds):
+        if progress is not None:
+            progress(done, len(tasks), track_ids[index], seconds)
+
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with ProcessPoolExecutor(workers) as executor:
+            futures = {executor.submit(_run_track, task): index
+                       for index, task in enumerate(tasks)}
+            for done, future in enumerate(as_completed(futures), 1):
+                seconds, stats = future.result()
+                instrument.add(stats)
+                report(done, futures[future], seconds)
+    else:
+        for index, task in enumerate(tasks):
+            report(index + 1, index, _run_track(task)[0])
+
+
+def run(spec, selected_stages=None, workers=1, quiet=False, shard=None,
+        num_shards=None, profile=None):
+    '''
+    Runs the stages of `spec' (see read_spec) given in `selected_stages'
+    (default: all stages in the spec).  With `num_shards', the stimuli
+    stages only write the tracks of shard `shard', see
+    manifest.select_shard.
+
+    Returns the instrument.Stats of the run (of all worker processes).  If
+    `profile' is a filename, they are written to it as JSON.
+    '''
+
+    with instrument.collect() as stats:
+        _run(spec, selected_stages, workers, quiet, shard, num_shards)
+
+    if not quiet:
+        print(stats.table(), file=sys.stderr, flush=True)
+    if profile:
+        stats.to_json(profile)
+
+    return stats
+
+
+def _run(spec, selected_stages, workers, quiet, shard, num_shards):
+
+    if selected_stages is None:
+        selected_stages = [stage for stage in stages if stage in spec]
+
+    for stage in selected_stages:
+        if stage not in spec:
+            raise ValueError('Stage {} is not in the spec.'.format(stage))
+
+    settings = spec.get('config') or {}
+    configure(settings)
+
+    output = spec.get('output', '.')
+    if not os.path.exists(output):
+        os.makedirs(output)
+    sample_file = os.path.join(output, 'sample.csv')
+
+    def log(message):
+        if not quiet:
+            print(message, file=sys.stderr, flush=True)
+
+    def progress(done, total, track_id, seconds):
+        log('  [{0}/{1}] track {2} ({3:.1f} s)'.format(
+            done, total, track_id, seconds))
+
+    sample = None
+    for stage in stages:
+
+        if stage not in selected_stages:
+            continue
+
+        log('{}...'.format(stage))
+        start = time.time()
+        options = dict(spec[stage] or {})
+
+        if stage == 'selection':
+            sample = select(options)
+            sample.to_csv(sample_file, index=False)
+            log('  {0} tracks, {1} methods written to {2}'.format(
+                sample['track_id'].nunique(),
+                sample['method'].nunique(),
+                sample_file))
+        else:
+            if sample is None:
+                sample = pd.read_csv(sample_file)
+            options.setdefault('directory', output)
+
+            if stage in track_stages:
+                if num_shards is not None:
+                    options.update(shard=shard, num_shards=num_shards)
+                write_per_track(stage, sample, options, settings, workers,
+                                progress)
+            else:
+                from . import mushra
+                mushra.mixture_from_track_sample(sample, **options)
+
+        log('{0} done in {1:.1f} s'.format(stage, time.time() - start))
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(
+        prog='masseval',
+        description=' '.join(__doc__.split('\n\n')[0].split()),
+        epilog='Stages: {}'.format(', '.join(stages)))
+    parser.add_argument('spec', help='YAML file describing the test')
+    parser.add_argument('--stages', nargs='+', choices=stages,
+                        help='stages to run (default: all in the spec)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes writing stimuli of tracks in '
+                             'parallel')
+    parser.add_argument('--shard', type=int,
+                        help='only write the stimuli of this shard '
+                             '(0 to NUM_SHARDS - 1)')
+    parser.add_argument('--num-shards', type=int,
+                        help='number of shards the tracks are split into')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='write time, calls and bytes read and written '
+                             'per stage and track to FILE (JSON)')
+    parser.add_argument('--quiet', action='store_true',
+                        help='do not report progress')
+    args = parser.parse_args(argv)
+
+    if (args.shard is None) != (args.num_shards is None):
+        parser.error('--shard and --num-shards must be given together')
+
+    run(read_spec(args.spec), args.stages, args.workers, args.quiet,
+        args.shard, args.num_shards, args.profile)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,3 +12,8 @@ dsd_base_path = None
 mushra_config_file = None
 fs = 44100
 audio_encoding = 'float32'
+# Directory in RAM (tmpfs) for temporary files, see audio.peass(in_memory)
+ram_dir = '/dev/shm'
+# Backend of MATLAB sessions, 'matlab_wrapper' or 'local' (a stand-in
+# without MATLAB), see sessions.start_session()
+matlab_backend = 'matlab_wrapper'
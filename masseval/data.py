@@ -1,10 +1,7 @@
 import warnings
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sb
 import os
-import massdatasets
 from . import config
 
 
@@ -83,6 +80,8 @@ def get_dsd100_df(base_path=None):
     if not base_path:
         base_path = config.dsd_base_path
 
+    import massdatasets
+
     ds = massdatasets.Dataset.read(config.dsd_yaml)
 
     ds.base_path = base_path
@@ -95,7 +94,7 @@ def add_reference_to_sample(sample):
 
     df = get_dsd100_df(config.dsd_base_path)
 
-    out = pd.DataFrame(columns=sample.columns)
+    refs = []
     for idx, group in sample.groupby('track_id'):
         ref = group.iloc[0].copy()
         for stem in ['vocals', 'drums', 'bass', 'other']:
@@ -103,8 +102,8 @@ def add_reference_to_sample(sample):
             ref['score'] = np.nan
             ref['filename'] = ''
             ref['target'] = stem
-            out = out.append(ref)
-    out = out.reset_index(drop=True)
+            refs.append(ref.copy())
+    out = pd.DataFrame(refs, columns=sample.columns).reset_index(drop=True)
 
     for idx, g in out.iterrows():
 
@@ -115,7 +114,7 @@ def add_reference_to_sample(sample):
 
         out.loc[idx, 'filepath'] = temp['audio_filepath'].values[0]
 
-    out = sample.append(out).reset_index(drop=True)
+    out = pd.concat([sample, out]).reset_index(drop=True)
 
     return out.sort_values(by=['track_id', 'method', 'target'])
 
@@ -260,6 +259,9 @@ def get_sample(df,
                                   num_algos=num_algos,
                                   remove_outliers=remove_outliers)
     if selection_plot:
+        import matplotlib.pyplot as plt
+        import seaborn as sb
+
         plt.figure(1)
         sb.boxplot(sub_df.score, groupby=sub_df.track_id)
         sb.swarmplot(sub_df.track_id, sub_df.score, color=".25")
@@ -270,7 +272,7 @@ def get_sample(df,
         sb.swarmplot(sample.track_id, sample.score, color=".25")
         plt.show()
 
-    out = pd.DataFrame()
+    subs = []
     # Add other sources back in, removing accompaniment if others are present
     for idx, g in sample.groupby(['track_id', 'method']):
 
@@ -281,9 +283,9 @@ def get_sample(df,
         if len(sub.target) == 5:
             sub = sub[sub.target != 'accompaniment']
 
-        out = out.append(sub)
+        subs.append(sub)
 
-    out = add_reference_to_sample(out)
+    out = add_reference_to_sample(pd.concat(subs))
 
     return out
 
@@ -0,0 +1,216 @@
+'''
+Counters of the stages of the stimulus pipeline: number of calls, wall
+time and bytes read and written, per stage and per track.
+
+Instrumented functions are decorated with timed(); the writers loop over
+tracks with tracks().  Everything recorded while a collect() block is
+active is added to its Stats, which can be sent back from worker processes
+and merged:
+
+    with instrument.collect() as stats:
+        audio.write_target_from_sample(sample, directory='/tmp/test')
+    print(stats.table())
+
+The writers do this themselves when called with `profile' (see reported()).
+Times are inclusive, e.g. the time of write_wav is also part of the time of
+the writer calling it.
+'''
+
+from contextlib import contextmanager
+import functools
+import json
+import inspect
+import threading
+import time
+
+columns = ['stage', 'track_id', 'calls', 'seconds', 'bytes_read',
+           'bytes_written']
+
+_local = threading.local()
+_lock = threading.Lock()
+_collectors = []
+
+
+class Stats:
+    '''
+    Counters per (stage, track): calls, seconds, bytes read and written.
+    '''
+
+    def __init__(self, counters=None):
+        self.counters = dict(counters or {})
+
+    def add(self, stage, track_id, calls=0, seconds=0, bytes_read=0,
+            bytes_written=0):
+
+        key = (stage, track_id)
+        counter = self.counters.get(key, (0, 0, 0, 0))
+        self.counters[key] = (counter[0] + calls,
+                              counter[1] + seconds,
+                              counter[2] + bytes_read,
+                              counter[3] + bytes_written)
+
+    def merge(self, other):
+        '''
+        Adds the counters of another Stats, e.g. from a worker process.
+        '''
+
+        for (stage, track_id), counter in other.counters.items():
+            self.add(stage, track_id, *counter)
+
+    def to_df(self, per_track=False):
+        '''
+        Returns the counters as a DataFrame, one row per stage (and track if
+        `per_track').
+        '''
+
+        import pandas as pd
+
+        df = pd.DataFrame([(stage, track_id) + counter
+                           for (stage, track_id), counter
+                           in self.counters.items()],
+                          columns=columns)
+
+        if not per_track:
+            df = df.drop(columns='track_id').groupby(
+                'stage', as_index=False).sum()
+
+        return df.sort_values('seconds', ascending=False,
+                              ignore_index=True)
+
+    def table(self, per_track=False):
+        '''
+        Returns the counters as a printable table.
+        '''
+        return self.to_df(per_track).to_string(index=False)
+
+    def to_json(self, filename):
+        '''
+        Writes the counters per stage and track as JSON records.
+        '''
+
+        records = [dict(zip(columns, (stage, track_id) + counter))
+                   for (stage, track_id), counter in self.counters.items()]
+
+        with open(filename, 'w') as file:
+            json.dump(records, file, indent=1, default=str)
+
+
+@contextmanager
+def collect():
+    '''
+    Context manager yielding a Stats with everything recorded inside the
+    block (in this process).
+    '''
+
+    stats = Stats()
+    with _lock:
+        _collectors.append(stats)
+    try:
+        yield stats
+    finally:
+        with _lock:
+            _collectors.remove(stats)
+
+
+def add(stats):
+    '''
+    Adds a Stats (e.g. returned by call_collected in a worker process) to
+    the counters of this process.
+    '''
+
+    with _lock:
+        for collector in _collectors:
+            collector.merge(stats)
+
+
+def call_collected(function, *args, **kwargs):
+    '''
+    Returns function(*args, **kwargs) and the Stats recorded during the
+    call, to run instrumented code in worker processes, see add().
+    '''
+
+    with collect() as stats:
+        result = function(*args, **kwargs)
+
+    return result, stats
+
+
+def record(stage, calls=0, seconds=0, bytes_read=0, bytes_written=0):
+    '''
+    Adds to the counters of `stage' for the current track.
+    '''
+
+    if not _collectors:
+        return
+
+    track_id = getattr(_local, 'track_id', None)
+    with _lock:
+        for stats in _collectors:
+            stats.add(stage, track_id, calls, seconds, bytes_read,
+                      bytes_written)
+
+
+def tracks(groups):
+    '''
+    Yields the (track_id, rows) of `groups' (e.g. a DataFrame grouped by
+    track_id) and attributes everything recorded (in this thread) while an
+    item is processed to its track.
+    '''
+
+    previous = getattr(_local, 'track_id', None)
+    try:
+        for track_id, rows in groups:
+            _local.track_id = track_id
+            yield track_id, rows
+    finally:
+        _local.track_id = previous
+
+
+def timed(stage):
+    '''
+    Decorator counting calls and wall time of a function as `stage'.
+    '''
+
+    def decorator(function):
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _collectors:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(stage, 1, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def reported(stage):
+    '''
+    Decorator for the writers, counting calls and wall time as `stage' like
+    timed().  If the function is called with `profile' True, a table of all
+    stages of the call is printed when it finishes, if `profile' is a
+    filename, the counters per stage and track are written to it as JSON.
+    '''
+
+    def decorator(function):
+
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profile = signature.bind(*args, **kwargs).arguments.get('profile')
+            with collect() as stats:
+                result = timed(stage)(function)(*args, **kwargs)
+            if profile is True:
+                print(stats.table())
+            elif profile:
+                stats.to_json(profile)
+            return result
+
+        return wrapper
+
+    return decorator
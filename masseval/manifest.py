@@ -0,0 +1,262 @@
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+from .cache import hash_parameters
+
+
+def hash_file(filename, chunk_size=2 ** 20):
+    '''
+    Returns the hex sha1 digest of the content of a file.
+    '''
+
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+class Manifest:
+    '''
+    Record of the stimuli written to `directory' by
+    audio.write_mixtures_from_sample() and audio.write_target_from_sample(),
+    stored as JSON in `directory'/`filename'.
+
+    Every entry (one per writer and track) holds the digests of the input
+    files, a digest of the parameters and the size, modification time and
+    checksum of every output file.  An entry is current if the inputs and
+    parameters are unchanged and all outputs still exist unchanged, in which
+    case the writers skip the track.
+
+    File digests are reused as long as size and modification time of a file
+    are unchanged, so checking an unchanged build reads no audio.  The file
+    is updated after every track (under a lock, so several processes can
+    write to the same manifest), which makes interrupted builds resumable.
+    '''
+
+    def __init__(self, directory, filename='manifest.json'):
+
+        self.directory = directory
+        self.filename = os.path.join(directory, filename)
+        self.entries = {}
+        # path -> [size, mtime_ns, sha1] of hashed files
+        self.digests = {}
+        self.load()
+
+    def load(self):
+        '''
+        (Re)reads the manifest file.
+        '''
+
+        if not os.path.exists(self.filename):
+            return
+
+        with open(self.filename) as file:
+            stored = json.load(file)
+
+        self.entries.update(stored.get('entries', {}))
+        self.digests.update(stored.get('digests', {}))
+
+    def save(self):
+        '''
+        Writes the manifest, atomically.
+        '''
+
+        tmp_filename = '{0}.{1}.tmp'.format(self.filename, os.getpid())
+        with open(tmp_filename, 'w') as file:
+            json.dump({'entries': self.entries, 'digests': self.digests},
+                      file, indent=1, sort_keys=True)
+        os.replace(tmp_filename, self.filename)
+
+    @contextmanager
+    def _lock(self):
+        import fcntl
+        with open(self.filename + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def digest(self, filename):
+        '''
+        Returns the sha1 digest of a file, reusing the stored one if the size
+        and modification time of the file are unchanged.
+        '''
+
+        stat = os.stat(filename)
+        path = os.path.abspath(filename)
+        stored = self.digests.get(path)
+
+        if stored is None or stored[:2] != [stat.st_size, stat.st_mtime_ns]:
+            stored = [stat.st_size, stat.st_mtime_ns, hash_file(filename)]
+            self.digests[path] = stored
+
+        return stored[2]
+
+    def input_digests(self, filenames):
+        '''
+        Returns a dictionary of filename -> digest.
+        '''
+        return {filename: self.digest(filename)
+                for filename in sorted(set(filenames))}
+
+    def is_current(self, key, inputs, parameters):
+        '''
+        Returns True if the entry `key' was recorded with the same `inputs'
+        (see input_digests) and `parameters' and all its outputs are
+        unchanged.
+        '''
+
+        entry = self.entries.get(key)
+        if (entry is None or
+                entry['inputs'] != inputs or
+                entry['parameters'] != hash_parameters(parameters)):
+            return False
+
+        for name, checksum in entry['outputs'].items():
+            filename = os.path.join(self.directory, name)
+            if not os.path.exists(filename) or (
+                    self.digest(filename) != checksum):
+                return False
+
+        return True
+
+    def record(self, key, inputs, parameters, outputs, track_id=None):
+        '''
+        Stores the entry `key' (of track `track_id') with the written
+        `outputs' (filenames).
+        '''
+
+        entry = {
+            'track_id': None if track_id is None else str(track_id),
+            'inputs': inputs,
+            'parameters': hash_parameters(parameters),
+            'outputs': {os.path.relpath(filename, self.directory):
+                        self.digest(filename)
+                        for filename in outputs},
+        }
+
+        with self._lock():
+            # Keep entries of other processes writing to the same manifest
+            digests = self.digests
+            self.load()
+            self.digests.update(digests)
+            self.entries[key] = entry
+            self.save()
+
+
+def shard_filename(shard, num_shards):
+    '''
+    Name of the manifest of one shard of a build.
+    '''
+    return 'manifest-{0}-of-{1}.json'.format(shard, num_shards)
+
+
+def from_argument(manifest, directory, shard=None, num_shards=None):
+    '''
+    Returns the Manifest for the `manifest' argument of the writers: None,
+    True (a manifest in `directory', one per shard if the build is sharded)
+    or a Manifest.
+    '''
+
+    if manifest is None or manifest is False:
+        return None
+    if manifest is True:
+        if num_shards is None:
+            return Manifest(directory)
+        return Manifest(directory, shard_filename(shard, num_shards))
+
+    return manifest
+
+
+def shard_of(track_id, num_shards):
+    '''
+    Returns the shard (0 to num_shards - 1) of a track.  The shard only
+    depends on the track id, not on the Python process (unlike hash()).
+    '''
+
+    digest = hashlib.sha1(str(track_id).encode()).hexdigest()
+
+    return int(digest, 16) % num_shards
+
+
+def select_shard(sample, shard, num_shards):
+    '''
+    Returns the rows of the tracks of `sample' in shard `shard' of
+    `num_shards', so every track is in exactly one shard.  If both are
+    None, all rows are returned.
+    '''
+
+    if (shard is None) != (num_shards is None):
+        raise ValueError('shard and num_shards must be given together')
+
+    if num_shards is None:
+        return sample
+
+    if not 0 <= shard < num_shards:
+        raise ValueError('shard must be between 0 and {}.'.format(
+            num_shards - 1))
+
+    shards = sample['track_id'].map(lambda track_id:
+                                    shard_of(track_id, num_shards))
+
+    return sample[shards == shard]
+
+
+def merge(directory, num_shards, sample, filename='manifest.json'):
+    '''
+    Combines the manifests written by the shards of a build (see the
+    `shard' and `num_shards' arguments of the writers) of the tracks in
+    `sample' into one manifest in `directory' and returns it.
+
+    Raises ValueError if the manifest of a shard with tracks is missing, a
+    manifest contains tracks of another shard, or a writer did not record
+    every track of `sample'.
+    '''
+
+    expected = {str(track_id) for track_id in sample['track_id']}
+
+    merged = Manifest(directory, filename)
+    merged.entries = {}
+
+    for shard in range(num_shards):
+
+        path = os.path.join(directory, shard_filename(shard, num_shards))
+        if not os.path.exists(path):
+            if any(shard_of(track_id, num_shards) == shard
+                   for track_id in expected):
+                raise ValueError('Manifest of shard {0} missing: {1}'.format(
+                    shard, path))
+            continue
+
+        with open(path) as file:
+            stored = json.load(file)
+
+        for key, entry in stored['entries'].items():
+            track_id = entry.get('track_id')
+            if (track_id is not None and
+                    shard_of(track_id, num_shards) != shard):
+                raise ValueError(
+                    'Track {0} is in the manifest of shard {1}, '
+                    'but belongs to shard {2}.'.format(
+                        track_id, shard, shard_of(track_id, num_shards)))
+            merged.entries[key] = entry
+
+        merged.digests.update(stored.get('digests', {}))
+
+    writers = {}
+    for key, entry in merged.entries.items():
+        writers.setdefault(key.split('/')[0], set()).add(
+            entry.get('track_id'))
+    for writer, track_ids in sorted(writers.items()):
+        missing = expected - track_ids
+        if missing:
+            raise ValueError('{0} is missing tracks {1}'.format(
+                writer, ', '.join(sorted(missing))))
+
+    merged.save()
+
+    return merged
@@ -1,5 +1,8 @@
+from copy import deepcopy
 import os
+import struct
 
+import pandas as pd
 import yaml
 from lxml import etree
 
@@ -12,31 +15,34 @@ def mixture_from_track_sample(sample,
                               mixing_levels=[0, 6, 12]):
 
     with open(config.mushra_config_file, 'r') as ymlfile:
-        mushra_config = yaml.load(ymlfile)
+        mushra_config = yaml.safe_load(ymlfile)
 
     sample = sample[sample['method'] != 'ref']
 
     if not os.path.exists(directory):
         os.makedirs(directory)
 
+    # Stimulus folder and methods of every track
+    tracks = []
+    for track_id, g_sample in sample.groupby('track_id'):
+        folder = '{0}-{1}-{2}'.format('mix',
+                                      track_id,
+                                      g_sample.iloc[0]['metric'])
+        tracks.append((folder, g_sample['method'].unique()))
+
+    xsi_namespace = 'http://www.w3.org/2001/XMLSchema-instance'
+    xsi = '{%s}' % xsi_namespace
+
     # Create different configuration files for every question
     for question_id, question in mushra_config['questions'].items():
 
-        # Start config file for the MUSHRA test
-        xsi_namespace = 'http://www.w3.org/2001/XMLSchema-instance'
-        xsi = '{%s}' % xsi_namespace
-        nsmap = {None: xsi_namespace}  # the default namespace (no prefix)
-        # <waet>
-        waet = etree.Element(xsi + 'waet', nsmap=nsmap)  # lxml only!
-        waet.set(xsi + 'noNamespaceSchemaLocation', 'test-schema.xsd')
-
         # <setup>
-        setup = etree.SubElement(waet, 'setup',
-                                 interface='MUSHRA',
-                                 projectReturn='save.php',
-                                 randomiseOrder='true',
-                                 crossFade='0.01',
-                                 loudness='-23')
+        setup = etree.Element('setup',
+                              interface='MUSHRA',
+                              projectReturn='save.php',
+                              randomiseOrder='true',
+                              crossFade='0.01',
+                              loudness='-23')
         #   <exitText/>
         etree.SubElement(setup, 'exitText').text = (
                 mushra_config['exit_message'])
@@ -63,76 +69,332 @@ def mixture_from_track_sample(sample,
         #   </interface>
         # </setup>
 
-        for level in mixing_levels:
-
-            # Iterate over the tracks and write audio out:
-            for g_sample in sample.groupby('track_id'):
-
-                folder = '{0}-{1}-{2}'.format(
-                        'mix',
-                        g_sample[1].iloc[0]['track_id'],
-                        g_sample[1].iloc[0]['metric'])
-
-                # <page>
-                page = etree.SubElement(waet, 'page')
-                page_id = folder.replace('mix', question_id) + \
-                    '_' + str(level) + 'dB'
-                page.set('id', page_id)
-                page.set('hostURL', 'stim/' + folder + '/')
-                for option in sorted(mushra_config['page']):
-                    page.set(option, mushra_config['page'][option])
-
-                #   <interface>
-                page_interface = etree.SubElement(page, 'interface')
-                #       <title/>
-                etree.SubElement(page_interface, 'title').text = \
-                    question['title']
-                #       <scales>
-                scales = etree.SubElement(page_interface, 'scales')
-                for label in sorted(question['scale']):
-                    scale = etree.SubElement(scales, 'scalelabel')
-                    scale.text = question['scale'][label]
-                    scale.set('position', str(label))
-                #       </scales>
-                #   </interface>
-
-                #   <audioelement/>
-                ref = etree.SubElement(page, 'audioelement')
-                ref.set('url', 'ref_mix_' + str(level) + 'dB.wav')
-                ref.set('id', page_id + '_refout')
-                ref.set('type', 'outside-reference')
-                hidden_ref = etree.SubElement(page, 'audioelement')
-                hidden_ref.set('url', 'ref_mix_' + str(level) + 'dB.wav')
-                hidden_ref.set('id', page_id + '_ref')
-                hidden_ref.set('type', 'reference')
-                anchor = etree.SubElement(page, 'audioelement')
-                anchor_file = 'anchor_' + question_id + '_mix_' + \
-                    str(level) + 'dB.wav'
-                anchor.set('url', anchor_file)
-                anchor.set('id', page_id + '_anchor')
-                anchor.set('type', 'anchor')
-                for method in g_sample[1]['method'].unique():
-                    alg = etree.SubElement(page, 'audioelement')
-                    alg.set('url', method + '_mix_' + str(level) + 'dB.wav')
-                    alg.set('id', page_id + '_' + method)
-                # </page>
-                # </waet>
+        page_template = _page_template(question, mushra_config)
 
-        tree = etree.ElementTree(waet)
         filename = os.path.join(
                 directory,
                 mushra_config['testname'] + '_' + question_id + '.xml')
-        tree.write(filename,
-                   pretty_print=True,
-                   xml_declaration=True,
-                   encoding='UTF-8')
 
-        # Workaround to remove one xml namespace entry
-        with open(filename, 'r') as file:
-            filedata = file.read()
+        # Stream the config file, one page at a time
+        with open(filename, 'wb') as file:
+            with etree.xmlfile(file, encoding='UTF-8') as xf:
+                xf.write_declaration()
+                # <waet>
+                with xf.element('waet',
+                                {xsi + 'noNamespaceSchemaLocation':
+                                 'test-schema.xsd'},
+                                nsmap={'xsi': xsi_namespace}):
+
+                    _write_indented(xf, setup)
+
+                    for level in mixing_levels:
+                        for folder, methods in tracks:
+                            _write_indented(
+                                xf,
+                                _page(question_id, level, folder, methods,
+                                      page_template))
+
+                    xf.write('\n')
+                # </waet>
+            # The serialiser cannot write text after the root element
+            file.write(b'\n')
+
+
+def _write_indented(xf, element):
+    '''
+    Writes `element' pretty printed as a child of the root element.
+    '''
+
+    etree.indent(element, level=1)
+    xf.write('\n  ', element)
+
+
+def _page_template(question, mushra_config):
+    '''
+    Returns a <page> element with the options and the <interface> shared by
+    all pages of a question, to be copied by _page().
+    '''
+
+    # <page>
+    page = etree.Element('page')
+    for option in sorted(mushra_config['page']):
+        page.set(option, mushra_config['page'][option])
+
+    #   <interface>
+    page_interface = etree.SubElement(page, 'interface')
+    #       <title/>
+    etree.SubElement(page_interface, 'title').text = \
+        question['title']
+    #       <scales>
+    scales = etree.SubElement(page_interface, 'scales')
+    for label in sorted(question['scale']):
+        scale = etree.SubElement(scales, 'scalelabel')
+        scale.text = question['scale'][label]
+        scale.set('position', str(label))
+    #       </scales>
+    #   </interface>
+    # </page>
+
+    return page
+
+
+def _page(question_id, level, folder, methods, page_template):
+    '''
+    Returns the <page> element of one track at one mixing level.
+    '''
+
+    # <page>
+    page = etree.Element('page')
+    page_id = folder.replace('mix', question_id) + \
+        '_' + str(level) + 'dB'
+    page.set('id', page_id)
+    page.set('hostURL', 'stim/' + folder + '/')
+    page.attrib.update(page_template.attrib)
+
+    #   <interface>
+    page.append(deepcopy(page_template[0]))
+
+    #   <audioelement/>
+    ref = etree.SubElement(page, 'audioelement')
+    ref.set('url', 'ref_mix_' + str(level) + 'dB.wav')
+    ref.set('id', page_id + '_refout')
+    ref.set('type', 'outside-reference')
+    hidden_ref = etree.SubElement(page, 'audioelement')
+    hidden_ref.set('url', 'ref_mix_' + str(level) + 'dB.wav')
+    hidden_ref.set('id', page_id + '_ref')
+    hidden_ref.set('type', 'reference')
+    anchor = etree.SubElement(page, 'audioelement')
+    anchor_file = 'anchor_' + question_id + '_mix_' + \
+        str(level) + 'dB.wav'
+    anchor.set('url', anchor_file)
+    anchor.set('id', page_id + '_anchor')
+    anchor.set('type', 'anchor')
+    for method in methods:
+        alg = etree.SubElement(page, 'audioelement')
+        alg.set('url', method + '_mix_' + str(level) + 'dB.wav')
+        alg.set('id', page_id + '_' + method)
+    # </page>
+
+    return page
+
+
+def results_from_files(filenames, sample=None, target='vocals', workers=1):
+    '''
+    Reads the results of MUSHRA tests created with
+    mixture_from_track_sample(), i.e. the XML files saved by the Web Audio
+    Evaluation Tool, into a DataFrame with one row per rating:
+
+        subject, page, question, track_id, metric, level, method, rating
+
+    `filenames' is a list of result files or a directory containing them.
+    The subject is the key of the result (or the file name if there is
+    none), ratings are scaled from 0 to 100 and the outside reference,
+    which cannot be rated, is skipped.
+
+    If `sample' (as returned by data.get_sample) is given, the rows of
+    `target' are joined to the ratings by track, metric and method.
+
+    With workers > 1, the files are parsed in that many processes.
+    '''
+
+    if isinstance(filenames, str):
+        filenames = sorted(os.path.join(filenames, name)
+                           for name in os.listdir(filenames)
+                           if name.endswith('.xml'))
+
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(workers) as executor:
+            rows = list(executor.map(_read_results, filenames,
+                                     chunksize=16))
+    else:
+        rows = [_read_results(filename) for filename in filenames]
+
+    columns = ['subject', 'page', 'question', 'track_id', 'metric', 'level',
+               'method', 'rating']
+    df = pd.DataFrame([row for file_rows in rows for row in file_rows],
+                      columns=columns)
+
+    if sample is not None:
+        sample = sample[sample['target'] == target]
+        df = df.merge(sample, how='left', on=['track_id', 'metric', 'method'])
+
+    return df
+
+
+def _read_results(filename):
+    '''
+    Returns a list of rows (dictionaries) of the ratings in one result file.
+    '''
+
+    rows = []
+    subject = os.path.splitext(os.path.basename(filename))[0]
+
+    for event, element in etree.iterparse(filename,
+                                          events=('start', 'end'),
+                                          tag=('waetresult', 'page')):
+
+        if element.tag == 'waetresult':
+            if event == 'start':
+                subject = element.get('key', subject)
+            continue
+
+        if event == 'start':
+            continue
+
+        # Result files embed a copy of the test spec (<waet>), whose pages
+        # have an id instead of a ref
+        page_id = element.get('ref')
+        if element.getparent().tag != 'waetresult' or page_id is None:
+            element.clear()
+            continue
+
+        # Page ids are <question>-<track_id>-<metric>_<level>dB
+        name, level = page_id.rsplit('_', 1)
+        question, track_id, metric = name.rsplit('-', 2)
+        if track_id.isdigit():
+            track_id = int(track_id)
+
+        for audioelement in element.iterfind('audioelement'):
+            value = audioelement.findtext('value')
+            if value is None:
+                continue
+            rows.append({
+                'subject': subject,
+                'page': page_id,
+                'question': question,
+                'track_id': track_id,
+                'metric': metric,
+                'level': int(level[:-len('dB')]),
+                'method': audioelement.get('ref')[len(page_id) + 1:],
+                'rating': float(value) * 100,
+            })
+
+        # Free the parsed page (and those before it)
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+    return rows
+
+
+def validate_config(filename,
+                    directory,
+                    sample_rate=None,
+                    duration=None,
+                    tolerance=0.01):
+    '''
+    Checks that all audio files referenced by a MUSHRA config created with
+    mixture_from_track_sample() exist.  `directory' is the directory the
+    hostURL of the pages is relative to (the root of the Web Audio
+    Evaluation Tool).
+
+    Every stimulus folder is listed once.  If `sample_rate' or `duration'
+    (in seconds) is given, the WAV headers of the files are read (but no
+    audio) to check their sample rate, their duration (within `tolerance'
+    seconds) and that all files of a page have the same length.
+
+    Returns a DataFrame with the page, url, path and problem of every
+    problem found, which is empty if the config is fine.
+    '''
+
+    check_headers = sample_rate is not None or duration is not None
+
+    problems = []
+    folders = {}
+
+    for page in etree.parse(filename).getroot().iterfind('page'):
+
+        page_id = page.get('id')
+        folder = os.path.join(directory, page.get('hostURL', ''))
+
+        if folder not in folders:
+            try:
+                folders[folder] = {entry.name for entry in
+                                   os.scandir(folder) if entry.is_file()}
+            except FileNotFoundError:
+                folders[folder] = set()
+
+        lengths = {}
+        for audioelement in page.iterfind('audioelement'):
+
+            url = audioelement.get('url')
+            path = os.path.join(folder, url)
+
+            def problem(text):
+                problems.append({'page': page_id,
+                                 'url': url,
+                                 'path': path,
+                                 'problem': text})
+
+            if url not in folders[folder]:
+                problem('missing')
+                continue
+
+            if not check_headers:
+                continue
+
+            try:
+                fs, num_channels, num_frames = wav_header(path)
+            except ValueError as error:
+                problem(str(error))
+                continue
+
+            if sample_rate is not None and fs != sample_rate:
+                problem('sample rate is {0}, not {1}'.format(
+                    fs, sample_rate))
+            if (duration is not None and
+                    abs(num_frames / fs - duration) > tolerance):
+                problem('duration is {0:.3f} s, not {1} s'.format(
+                    num_frames / fs, duration))
+            lengths[url] = num_frames
+
+        if len(set(lengths.values())) > 1:
+            problems.append({'page': page_id,
+                             'url': None,
+                             'path': folder,
+                             'problem': 'files differ in length: {}'.format(
+                                 ', '.join('{0} ({1})'.format(*item)
+                                           for item in
+                                           sorted(lengths.items())))})
+
+    return pd.DataFrame(problems, columns=['page', 'url', 'path', 'problem'])
+
+
+def wav_header(filename):
+    '''
+    Returns the sample rate, number of channels and number of frames of a
+    WAV file, reading only its header.  Raises ValueError if the file is
+    not a valid WAV file.
+    '''
+
+    fmt = None
+
+    with open(filename, 'rb') as file:
+
+        riff = file.read(12)
+        if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:] != b'WAVE':
+            raise ValueError('not a WAV file')
+
+        # Walk the chunks until the data chunk
+        while True:
+            header = file.read(8)
+            if len(header) < 8:
+                raise ValueError('no data chunk')
+            chunk_id, size = struct.unpack('<4sI', header)
+
+            if chunk_id == b'fmt ':
+                fmt = struct.unpack('<HHIIHH', file.read(16))
+                file.seek(size - 16 + size % 2, os.SEEK_CUR)
+            elif chunk_id == b'data':
+                break
+            else:
+                # Chunks are padded to an even size
+                file.seek(size + size % 2, os.SEEK_CUR)
+
+    if fmt is None:
+        raise ValueError('no fmt chunk')
 
-        xmlns_string = 'xmlns="http://www.w3.org/2001/XMLSchema-instance" '
-        filedata = filedata.replace(xmlns_string, '')
+    _, num_channels, sample_rate, _, block_align, _ = fmt
 
-        with open(filename, 'w') as file:
-            file.write(filedata)
+    return sample_rate, num_channels, size // block_align
@@ -0,0 +1,272 @@
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from . import config
+
+
+class SessionError(RuntimeError):
+    '''
+    Raised when a MATLAB session died while it was in use.
+    '''
+
+
+class LocalSession:
+    '''
+    Stand-in for a MATLAB session, with the same eval/put/get interface, to
+    test and load test the PEASS code (audio.peass, audio.peass_batch,
+    MatlabPool) without MATLAB.
+
+    Calls to PEASS_ObjectiveMeasure return synthetic scores in [0, 100),
+    which are derived from the samples of the estimate (as float32) and
+    therefore deterministic.  Audio written by audiowrite (see peass()'s
+    `in_memory') and wav files written by Python give the same scores.
+    Everything else is only stored (put/get) or ignored.
+
+    startup_latency:
+        Seconds to sleep when the session starts.
+    latency:
+        Seconds to sleep for every eval/put/get round trip.
+    peass_latency:
+        Seconds to sleep for every estimate evaluated by PEASS.
+    crash_rate:
+        Probability of the session dying on an eval, after which every
+        call raises RuntimeError (to test MatlabPool's recovery).
+    seed:
+        Seed of the crashes.  Note that sessions restarted with the same
+        seed crash at the same call again.
+    '''
+
+    def __init__(self,
+                 startup_latency=0,
+                 latency=0,
+                 peass_latency=0,
+                 crash_rate=0,
+                 seed=None):
+
+        self.latency = latency
+        self.peass_latency = peass_latency
+        self.crash_rate = crash_rate
+        self.random = np.random.RandomState(seed)
+        self.workspace = {}
+        self.files = {}
+        self.crashed = False
+        time.sleep(startup_latency)
+
+    def _round_trip(self):
+        if self.crashed:
+            raise RuntimeError('MATLAB session crashed')
+        time.sleep(self.latency)
+
+    def put(self, name, value):
+        self._round_trip()
+        self.workspace[name] = value
+
+    def get(self, name):
+        self._round_trip()
+        return self.workspace[name]
+
+    def eval(self, expression):
+
+        self._round_trip()
+
+        if self.crash_rate and self.random.rand() < self.crash_rate:
+            self.crashed = True
+            raise RuntimeError('MATLAB session crashed')
+
+        if 'audiowrite(' in expression:
+            signal = np.asarray(self.workspace['estimateSignal'], 'float32')
+            self.files[self.workspace['estimateFile']] = signal
+
+        if 'PEASS_ObjectiveMeasure' not in expression:
+            return
+
+        batch = re.search(r'estFiles = \{(.*?)\};', expression)
+        if batch:
+            est_files = [name.strip("'") for name in
+                         batch.group(1).split(';') if name]
+            time.sleep(self.peass_latency * len(est_files))
+            self.workspace['results'] = np.array(
+                [self.scores(name) for name in est_files]).reshape(-1, 4)
+        else:
+            time.sleep(self.peass_latency)
+            scores = self.scores(self.workspace['estimateFile'])
+            for name, score in zip(['ops', 'tps', 'ips', 'aps'], scores):
+                self.workspace[name] = score
+
+    def scores(self, filename):
+        '''
+        Synthetic OPS, TPS, IPS and APS of an estimate file, a hash of its
+        samples as float32 (integer wav files are scaled to [-1, 1)).
+        '''
+
+        if filename in self.files:
+            samples = self.files[filename]
+        elif os.path.exists(filename):
+            from scipy.io import wavfile
+            _, samples = wavfile.read(filename)
+            if samples.dtype.kind in 'iu':
+                info = np.iinfo(samples.dtype)
+                samples = ((samples.astype('float64') - info.min) /
+                           (2.0 ** (info.bits - 1)) - 1)
+            samples = samples.astype('float32')
+        else:
+            samples = None
+
+        if samples is None:
+            content = filename.encode()
+        else:
+            # Same layout for (samples,) and (samples, 1) audio
+            content = np.ascontiguousarray(samples.reshape(len(samples), -1))
+
+        digest = hashlib.sha1(content).digest()
+
+        return [int.from_bytes(digest[i:i + 4], 'big') / 2 ** 32 * 100
+                for i in range(0, 16, 4)]
+
+
+def _matlab_wrapper_session():
+    import matlab_wrapper
+    return matlab_wrapper.MatlabSession()
+
+
+# Available session backends, see start_session()
+backends = {
+    'matlab_wrapper': _matlab_wrapper_session,
+    'local': LocalSession,
+}
+
+
+def start_session(path_to_peass_toolbox, backend=None):
+    '''
+    Starts a MATLAB session with the PEASS toolbox on its path.
+
+    `backend' is the name of one of `backends' ('matlab_wrapper' or
+    'local', see LocalSession) or a function returning a new session.  It
+    defaults to config.matlab_backend.
+    '''
+
+    if backend is None:
+        backend = config.matlab_backend
+    if not callable(backend):
+        backend = backends[backend]
+
+    matlab = backend()
+    matlab.eval("addpath(genpath('{}'));".format(path_to_peass_toolbox))
+
+    return matlab
+
+
+def is_alive(matlab):
+    '''
+    Returns True if the session still answers a round trip.
+    '''
+
+    try:
+        matlab.put('masseval_ping', 1.0)
+        return float(matlab.get('masseval_ping')) == 1.0
+    except Exception:
+        return False
+
+
+class MatlabPool:
+    '''
+    A pool of warm MATLAB sessions with the PEASS toolbox already on the
+    path, so the start up cost is only paid once per session.
+
+    Sessions are handed out with session() or used through run(), which
+    replaces sessions that crashed.  The pool is thread safe: with `size`
+    sessions, up to `size` threads can evaluate at the same time, see
+    audio.peass_many().
+
+        with MatlabPool('/path/to/PEASS', size=4) as pool:
+            stats = audio.peass(refs, ests, pool=pool)
+
+    `backend' is passed to start_session(), e.g. to load test with
+    LocalSession:
+
+        pool = MatlabPool('', size=4,
+                          backend=lambda: LocalSession(peass_latency=1))
+    '''
+
+    def __init__(self, path_to_peass_toolbox, size=1, backend=None):
+
+        self.path_to_peass_toolbox = path_to_peass_toolbox
+        self.size = size
+        self.backend = backend
+        self._sessions = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+
+        for _ in range(size):
+            self._sessions.put(self._start())
+
+    def _start(self):
+        return start_session(self.path_to_peass_toolbox, self.backend)
+
+    @contextmanager
+    def session(self):
+        '''
+        Context manager handing out a session for exclusive use.  A session
+        found dead after an error is discarded, the error is raised as
+        SessionError and a fresh session is started the next time one is
+        needed.  Failing to start that session raises SessionError too.
+        '''
+
+        if self._closed:
+            raise ValueError('The pool has been closed.')
+
+        # None marks a session that needs to be (re)started
+        matlab = self._sessions.get()
+        if matlab is None:
+            try:
+                matlab = self._start()
+            except Exception as error:
+                self._sessions.put(None)
+                raise SessionError('MATLAB session did not start') from error
+
+        try:
+            yield matlab
+        except Exception as error:
+            if is_alive(matlab):
+                raise
+            matlab = None
+            raise SessionError('MATLAB session crashed') from error
+        finally:
+            self._sessions.put(matlab)
+
+    def run(self, function, *args, retries=1, **kwargs):
+        '''
+        Calls function(matlab, *args, **kwargs) with a session from the pool
+        and returns its result.  If the session crashed during the call, it
+        is restarted and the call repeated up to `retries` times.
+        '''
+
+        for attempt in range(retries + 1):
+            try:
+                with self.session() as matlab:
+                    return function(matlab, *args, **kwargs)
+            except SessionError:
+                if attempt == retries:
+                    raise
+
+    def close(self):
+        '''
+        Shuts down all sessions.
+        '''
+
+        with self._lock:
+            self._closed = True
+            # matlab_wrapper closes the engine once a session is deleted
+            while not self._sessions.empty():
+                self._sessions.get()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
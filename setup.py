@@ -28,12 +28,18 @@ setup(
         'pandas',
         'numpy',
         'untwist >= 0.1.dev0',
-        'lxml',
-        'mir_eval',
-        'matlab_wrapper',
+        'lxml >= 4.5',
+        'pyyaml',
     ],
+    entry_points={
+        'console_scripts': ['masseval = masseval.cli:main'],
+    },
     extras_require={
         'display': ['matplotlib>=1.5.0',
-                    'seaborn']
+                    'seaborn'],
+        # audio.bss_eval with engine='mir_eval' (the default)
+        'bss_eval': ['mir_eval'],
+        # audio.peass with the MATLAB PEASS toolbox
+        'peass': ['matlab_wrapper'],
     }
 )
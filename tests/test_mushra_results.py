@@ -0,0 +1,43 @@
+'''
+Tests of reading the result files of the Web Audio Evaluation Tool.
+'''
+
+import os
+
+import pandas as pd
+
+from masseval import mushra
+
+data_dir = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def test_results_skip_embedded_spec():
+
+    df = mushra.results_from_files(
+        [os.path.join(data_dir, 'result_with_spec.xml')])
+
+    assert list(df.columns) == ['subject', 'page', 'question', 'track_id',
+                                'metric', 'level', 'method', 'rating']
+    assert list(df.page) == ['quality-1-SDR_0dB'] * 3 + \
+        ['quality-1-SDR_6dB'] * 2
+    assert list(df.method) == ['ref', 'anchor', 'A', 'ref', 'A']
+    assert list(df.level) == [0, 0, 0, 6, 6]
+    assert (df.subject == 'subject-1').all()
+    assert (df.question == 'quality').all()
+    assert (df.track_id == 1).all()
+    assert (df.metric == 'SDR').all()
+    assert list(df.rating.round(6)) == [98, 12, 65, 100, 40]
+
+
+def test_results_join_sample():
+
+    sample = pd.DataFrame({'track_id': [1, 1],
+                           'metric': ['SDR', 'SDR'],
+                           'method': ['A', 'A'],
+                           'target': ['vocals', 'bass'],
+                           'score': [3.5, -1.0]})
+
+    df = mushra.results_from_files(data_dir, sample)
+
+    assert list(df[df.method == 'A'].score) == [3.5, 3.5]
+    assert df[df.method != 'A'].score.isnull().all()
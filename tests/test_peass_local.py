@@ -0,0 +1,124 @@
+'''
+Tests of the PEASS orchestration (audio.peass, audio.peass_batch,
+sessions.MatlabPool) with the local MATLAB stand-in, sessions.LocalSession.
+'''
+
+import numpy as np
+import pytest
+from untwist import data
+
+from masseval import audio, cache, config, sessions
+
+
+@pytest.fixture(autouse=True)
+def local_backend(monkeypatch):
+    monkeypatch.setattr(config, 'matlab_backend', 'local')
+
+
+def waves(seed, num=2, duration=0.5, sample_rate=44100):
+    random = np.random.RandomState(seed)
+    return [data.audio.Wave(0.1 * random.randn(int(duration * sample_rate),
+                                               1),
+                            sample_rate)
+            for _ in range(num)]
+
+
+def test_scores_are_deterministic():
+
+    refs, ests = waves(0), waves(1)
+
+    first = audio.peass(refs, ests)
+    second = audio.peass(refs, ests)
+
+    assert first == second
+    assert first[0] != first[1]
+    for stats in first:
+        assert all(0 <= score < 100 for score in stats)
+
+
+def test_scores_depend_on_estimate():
+
+    refs = waves(0)
+
+    assert audio.peass(refs, waves(1)) != audio.peass(refs, waves(2))
+
+
+def test_in_memory_matches_files():
+
+    refs, ests = waves(0), waves(1)
+
+    assert (audio.peass(refs, ests, in_memory=True) ==
+            audio.peass(refs, ests))
+
+
+def test_batch_matches_single():
+
+    items = {1: (waves(0), waves(1)), 2: (waves(2), waves(3))}
+
+    df = audio.peass_batch(items)
+
+    for row in df.itertuples():
+        refs, ests = items[row.track_id]
+        stats = audio.peass(refs, ests)[row.source]
+        assert (row.ops, row.tps, row.ips, row.aps) == tuple(stats)
+
+
+def test_cache_is_shared_between_modes(tmpdir):
+
+    refs, ests = waves(0), waves(1)
+    results = cache.ResultCache(str(tmpdir.join('results.db')))
+
+    in_memory = audio.peass(refs, ests, cache=results, in_memory=True)
+    cached = audio.peass(refs, ests, cache=results)
+
+    assert cached == in_memory == audio.peass(refs, ests)
+
+
+def test_pool_and_many():
+
+    items = [(waves(seed), waves(seed + 1)) for seed in range(4)]
+
+    with sessions.MatlabPool('', size=2) as pool:
+        pooled = audio.peass_many(items, pool=pool)
+
+    assert pooled == [audio.peass(refs, ests) for refs, ests in items]
+
+
+def test_pool_restarts_crashed_sessions():
+
+    refs, ests = waves(0), waves(1)
+    started = []
+
+    def backend():
+        session = sessions.LocalSession()
+        # The first restart crashes while starting up
+        if len(started) == 1:
+            session.crash_rate = 1
+        started.append(session)
+        return session
+
+    with sessions.MatlabPool('', size=1, backend=backend) as pool:
+        started[0].crash_rate = 1
+        stats = pool.run(audio._peass, refs, ests, retries=2)
+
+    assert len(started) == 3
+    assert stats == audio.peass(refs, ests)
+
+
+def test_many_uses_cache(tmpdir):
+
+    items = [(waves(seed), waves(seed + 1)) for seed in range(2)]
+    results = cache.ResultCache(str(tmpdir.join('results.db')))
+    evaluated = []
+
+    class Session(sessions.LocalSession):
+        def scores(self, filename):
+            evaluated.append(filename)
+            return super().scores(filename)
+
+    with sessions.MatlabPool('', size=2, backend=Session) as pool:
+        first = audio.peass_many(items, pool=pool, cache=results,
+                                 in_memory=True)
+        assert len(evaluated) == 4
+        assert audio.peass_many(items, pool=pool, cache=results) == first
+        assert len(evaluated) == 4